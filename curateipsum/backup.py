@@ -1,20 +1,37 @@
 """
 Module with backup functions.
 """
+import bisect
 import errno
 import logging
 import os
+import re
 import shutil
 import signal
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Iterable, Union
+from typing import Optional, Iterable, List, Sequence, Tuple, Union
 
 from curateipsum import fs
 
 BACKUP_ENT_FMT = "%Y%m%d_%H%M%S"
+# backup names matching BACKUP_ENT_FMT, checked without strptime; seconds
+# are omitted in old ones, so time is either HHMM or HHMMSS
+_BACKUP_NAME_RE = re.compile(r"[0-9]{8}_[0-9]{4}(?:[0-9]{2})?")
 LOCK_FILE = ".backups_lock"
+# lock file is empty for a moment between its creation and writing PID to it
+LOCK_READ_ATTEMPTS = 10
+LOCK_READ_DELAY = 0.1
 DELTA_DIR = ".backup_delta"
 BACKUP_MARKER = ".backup_finished"
+RMTREE_WORKERS = 4
+# backed up entries are processed in batches by several threads
+PROCESS_WORKERS = 8
+PROCESS_BATCH_SIZE = 256
+# actions after which there is no entry in backup to process
+_NOT_BACKED_ACTIONS = frozenset((fs.Actions.ERROR, fs.Actions.DELETE))
 _lg = logging.getLogger(__name__)
 
 
@@ -22,25 +39,43 @@ def _get_backup_marker(
         backup_entry: Union[os.DirEntry, fs.PseudoDirEntry]
 ) -> fs.PseudoDirEntry:
     """Return DirEntry for marker file of given backup."""
-    marker_name = "%s_%s" % (BACKUP_MARKER, backup_entry.name)
+    marker_name = _get_backup_marker_name(backup_entry.name)
     marker_path = os.path.join(backup_entry.path, marker_name)
     return fs.PseudoDirEntry(path=marker_path)
 
 
+def _get_backup_marker_name(backup_name: str) -> str:
+    """Return name of marker file for backup with given name."""
+    return f"{BACKUP_MARKER}_{backup_name}"
+
+
+def _get_lock_file_path(backups_dir: str) -> str:
+    """Return path to lock file of backups_dir."""
+    return os.path.join(backups_dir, LOCK_FILE)
+
+
 def _is_backup(backup_entry: Union[os.DirEntry, fs.PseudoDirEntry]) -> bool:
     """Guess if backup_entry is a real backup."""
-    backup_marker = _get_backup_marker(backup_entry)
-    # if there is no marker file in the backup dir, it's not a backup
-    if not os.path.exists(backup_marker.path):
-        return False
-    # if there is only a marker file in the backup dir, it's not a backup
-    if os.listdir(backup_entry.path) == [backup_marker.name]:
+    # cheap checks by entry name and type (known from scandir) go first,
+    # so other entries in backups_dir cost no extra syscalls
+    if _BACKUP_NAME_RE.fullmatch(backup_entry.name) is None:
         return False
     try:
-        datetime.strptime(backup_entry.name, BACKUP_ENT_FMT)
-        return True
+        _date_from_backup(backup_entry)
     except ValueError:
         return False
+    if not backup_entry.is_dir():
+        return False
+    # called for every entry in backups_dir, so PseudoDirEntry for marker is
+    # not created here, as it resolves marker path with extra syscalls
+    marker_name = _get_backup_marker_name(backup_entry.name)
+    # if there is no marker file in the backup dir, it's not a backup
+    if not os.path.exists(os.path.join(backup_entry.path, marker_name)):
+        return False
+    # if there is only a marker file in the backup dir, it's not a backup;
+    # stop scanning on the first other entry, backup could be huge
+    with os.scandir(backup_entry.path) as it:
+        return not all(ent.name == marker_name for ent in it)
 
 
 def _iterate_backups(backups_dir: str) -> Iterable[os.DirEntry]:
@@ -56,17 +91,48 @@ def _iterate_backups(backups_dir: str) -> Iterable[os.DirEntry]:
     b_iter.close()
 
 
-def _get_latest_backup(backups_dir: str) -> Optional[os.DirEntry]:
+def snapshot_backups(backups_dir: str) -> Tuple[os.DirEntry, ...]:
+    """
+    Scan backups_dir once and return all backups in it sorted by name.
+    Result could be passed to cleanup_old_backups and initiate_backup, so
+    backups_dir is not scanned again by each of them.
+    """
+    return tuple(sorted(_iterate_backups(backups_dir), key=lambda e: e.name))
+
+
+def _get_latest_backup(
+        backups_dir: str,
+        backups: Optional[Sequence[os.DirEntry]] = None,
+) -> Optional[os.DirEntry]:
     """Returns path to latest backup created in backups_dir or None."""
-    all_backups = sorted(_iterate_backups(backups_dir), key=lambda e: e.name)
-    if all_backups:
-        return all_backups[-1]
+    if backups is None:
+        # backup names are ordered by time, so only entries newer than the
+        # current best one are fully checked, in the single scan
+        best = None
+        with os.scandir(backups_dir) as it:
+            for ent in it:
+                if (_BACKUP_NAME_RE.fullmatch(ent.name) is not None
+                        and (best is None or ent.name > best.name)
+                        and _is_backup(ent)):
+                    best = ent
+        return best
+    if backups:
+        return backups[-1]
     return None
 
 
 def _date_from_backup(backup_entry: os.DirEntry) -> datetime:
     """Returns datetime object from backup name."""
-    return datetime.strptime(backup_entry.name, BACKUP_ENT_FMT)
+    # slice name directly instead of strptime, which re-parses format each call
+    n = backup_entry.name
+    return datetime(int(n[0:4]), int(n[4:6]), int(n[6:8]),
+                    int(n[9:11]), int(n[11:13]), int(n[13:15] or 0))
+
+
+def _backup_name_from_date(date: datetime) -> str:
+    """Returns backup name for datetime object, same as BACKUP_ENT_FMT."""
+    return (f"{date.year:04d}{date.month:02d}{date.day:02d}"
+            f"_{date.hour:02d}{date.minute:02d}{date.second:02d}")
 
 
 def _pid_exists(pid: int) -> bool:
@@ -97,6 +163,34 @@ def _pid_exists(pid: int) -> bool:
         return True
 
 
+def _read_lock_pid(
+        lock_file_path: str
+) -> Tuple[Optional[int], Optional[os.stat_result]]:
+    """
+    Return PID from lock file and stat of the file.
+    PID is None if lock file doesn't contain valid PID, stat is None if there
+    is no lock file.
+    """
+    for _ in range(LOCK_READ_ATTEMPTS):
+        try:
+            with open(lock_file_path, "r") as f:
+                lock_stat = os.fstat(f.fileno())
+                content = f.read()
+        except FileNotFoundError:
+            return None, None
+        if content:
+            break
+        # PID is not written yet by process which created the lock
+        time.sleep(LOCK_READ_DELAY)
+
+    try:
+        return int(content), lock_stat
+    except ValueError:
+        _lg.warning("Lock file has no valid PID, considering it stale: %r",
+                    content)
+        return None, lock_stat
+
+
 def set_backups_lock(backups_dir: str,
                      force: bool = False) -> bool:
     """
@@ -104,36 +198,53 @@ def set_backups_lock(backups_dir: str,
     Lock file contains PID of the process that created it.
     Return false if previous backup is still running and force flag is not set.
     """
-    lock_file_path = os.path.join(backups_dir, LOCK_FILE)
+    lock_file_path = _get_lock_file_path(backups_dir)
 
-    if not os.path.exists(lock_file_path):
-        with open(lock_file_path, "a") as f:
-            f.write(str(os.getpid()))
-        return True
+    while True:
+        # create lock file atomically, fails if it is already there
+        try:
+            fd = os.open(lock_file_path,
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            pass
+        else:
+            try:
+                os.write(fd, str(os.getpid()).encode())
+            finally:
+                os.close(fd)
+            return True
+
+        pid, lock_stat = _read_lock_pid(lock_file_path)
+        if lock_stat is None:
+            # lock is released meanwhile
+            continue
 
-    with open(lock_file_path, "r") as f:
-        pid = int(f.read())
+        if pid is not None and _pid_exists(pid):
+            if not force:
+                _lg.warning(
+                    "Previous backup is still in progress (PID: %d), exiting",
+                    pid
+                )
+                return False
 
-    if _pid_exists(pid):
-        if not force:
             _lg.warning(
-                "Previous backup is still in progress (PID: %d), exiting", pid
+                "Previous backup is still in progress (PID: %d), "
+                "but force flag is set, continuing", pid
             )
-            return False
-
-        _lg.warning(
-            "Previous backup is still in progress (PID: %d), "
-            "but force flag is set, continuing", pid
-        )
-        os.kill(pid, signal.SIGKILL)
+            os.kill(pid, signal.SIGKILL)
 
-    os.unlink(lock_file_path)
-    return True
+        # remove stale lock, unless other process has replaced it already,
+        # and try to create own one again
+        try:
+            if os.path.samestat(lock_stat, os.lstat(lock_file_path)):
+                os.unlink(lock_file_path)
+        except FileNotFoundError:
+            pass
 
 
 def release_backups_lock(backups_dir: str):
     """Remove lock file."""
-    lock_file_path = os.path.join(backups_dir, LOCK_FILE)
+    lock_file_path = _get_lock_file_path(backups_dir)
     if os.path.exists(lock_file_path):
         os.unlink(lock_file_path)
 
@@ -151,9 +262,12 @@ def cleanup_old_backups(backups_dir: str,
                         keep_daily: int = 30,
                         keep_weekly: int = 52,
                         keep_monthly: int = 12,
-                        keep_yearly: int = 5):
+                        keep_yearly: int = 5,
+                        backups: Optional[Sequence[os.DirEntry]] = None
+                        ) -> Tuple[os.DirEntry, ...]:
     """
     Delete old backups. Never deletes the only backup.
+    Return backups left after cleanup sorted by name, same as snapshot_backups.
     For keep_* params threshold is inclusive, e.g.:
     keep_weekly=1 being run on Thursday will keep one backup from this week and
     one from the previous, even if the previous week's backup was created on
@@ -175,134 +289,208 @@ def cleanup_old_backups(backups_dir: str,
     :param keep_yearly:
         up to this amount of years in the past one yearly backup must be kept.
         1 year is considered to be 365 days.
+    :param backups:
+        backups from snapshot_backups, backups_dir is scanned if not set.
     """
-    all_backups = sorted(_iterate_backups(backups_dir),
-                         key=lambda e: e.name, reverse=True)
+    if backups is None:
+        backups = snapshot_backups(backups_dir)
+    all_backups = list(reversed(backups))
     if dry_run:
         _lg.info("Dry-run, no backups will be actually removed")
     if not all_backups:
         _lg.debug("No backups, exiting")
-        return
+        return tuple(backups)
     if len(all_backups) == 1:
         _lg.debug("Only one backup (%s) exists, will not remove it",
                   all_backups[0].name)
-        return
+        return tuple(backups)
 
     now = datetime.now()
-    thresholds = {k: now.strftime(BACKUP_ENT_FMT)
+    thresholds = {k: _backup_name_from_date(now)
                   for k in ("all", "daily", "weekly", "monthly", "yearly")}
     if keep_all is not None:
-        thresholds["all"] = ((now - timedelta(days=keep_all))
-                             .replace(hour=0, minute=0, second=0)
-                             .strftime(BACKUP_ENT_FMT))
+        thresholds["all"] = _backup_name_from_date(
+            (now - timedelta(days=keep_all))
+            .replace(hour=0, minute=0, second=0)
+        )
     if keep_daily is not None:
-        thresholds["daily"] = ((now - timedelta(days=keep_daily))
-                               .replace(hour=0, minute=0, second=0)
-                               .strftime(BACKUP_ENT_FMT))
+        thresholds["daily"] = _backup_name_from_date(
+            (now - timedelta(days=keep_daily))
+            .replace(hour=0, minute=0, second=0)
+        )
     if keep_weekly is not None:
-        thresholds["weekly"] = (
-            (now - timedelta(weeks=keep_weekly, days=now.weekday()))
-            .strftime(BACKUP_ENT_FMT)
+        thresholds["weekly"] = _backup_name_from_date(
+            now - timedelta(weeks=keep_weekly, days=now.weekday())
         )
     if keep_monthly is not None:
-        thresholds["monthly"] = ((now - timedelta(days=30*keep_monthly))
-                                 .replace(day=1, hour=0, minute=0, second=0)
-                                 .strftime(BACKUP_ENT_FMT))
+        thresholds["monthly"] = _backup_name_from_date(
+            (now - timedelta(days=30*keep_monthly))
+            .replace(day=1, hour=0, minute=0, second=0)
+        )
     if keep_yearly is not None:
-        thresholds["yearly"] = (
+        thresholds["yearly"] = _backup_name_from_date(
             (now - timedelta(days=365*keep_yearly))
             .replace(month=1, day=1, hour=0, minute=0, second=0)
-            .strftime(BACKUP_ENT_FMT)
         )
 
-    prev_backup = all_backups[0]
-    to_remove = {b: False for b in all_backups}
-
-    for backup in all_backups[1:]:
-        # skip all backups made after threshold
-        if backup.name > thresholds["all"]:
-            prev_backup = backup
-            continue
-
-        # leave only one backup per day for backups made after threshold
-        if backup.name > thresholds["daily"]:
-            if (_date_from_backup(prev_backup).date()
-                    == _date_from_backup(backup).date()):
-                to_remove[prev_backup] = True
-            prev_backup = backup
-            continue
-
-        # leave only one backup per week for backups made after threshold
-        if backup.name > thresholds["weekly"]:
-            if (_date_from_backup(prev_backup).isocalendar()[1]
-                    == _date_from_backup(backup).isocalendar()[1]):
-                to_remove[prev_backup] = True
-            prev_backup = backup
-            continue
-
-        # leave only one backup per month for backups made after threshold
-        if backup.name > thresholds["monthly"]:
-            if (_date_from_backup(prev_backup).date().replace(day=1)
-                    == _date_from_backup(backup).date().replace(day=1)):
-                to_remove[prev_backup] = True
-            prev_backup = backup
-            continue
-
-        # leave only one backup per year for backups made after threshold
-        if backup.name > thresholds["yearly"]:
-            if (_date_from_backup(prev_backup).date().replace(month=1, day=1)
-                    == _date_from_backup(backup).date().replace(month=1, day=1)):
-                to_remove[prev_backup] = True
-            prev_backup = backup
-            continue
+    # all_backups is sorted by name in reverse order, so every tier is a
+    # contiguous slice; find tier boundaries with bisect on ascending names.
+    # Backup belongs to the first tier which threshold it is newer than.
+    names = [b.name for b in reversed(all_backups)]
+    bounds = []
+    threshold = None
+    for tier in ("all", "daily", "weekly", "monthly", "yearly"):
+        if threshold is None or thresholds[tier] < threshold:
+            threshold = thresholds[tier]
+        # the latest backup is never removed, so tiers start from index 1
+        bounds.append(
+            max(1, len(names) - bisect.bisect_right(names, threshold))
+        )
 
-        to_remove[backup] = True
+    to_remove = [False] * len(all_backups)
+
+    # skip all backups made after "all" threshold, and leave only one backup
+    # per day/week/month/year for backups made after corresponding threshold
+    dates = [_date_from_backup(b) for b in all_backups]
+    for period_key, start, end in (
+            (lambda d: d.toordinal(), bounds[0], bounds[1]),
+            (lambda d: d.isocalendar()[:2], bounds[1], bounds[2]),
+            (lambda d: (d.year, d.month), bounds[2], bounds[3]),
+            (lambda d: d.year, bounds[3], bounds[4]),
+    ):
+        # keep the oldest backup of every period; the newest backup of tier is
+        # grouped with the previous backup too, as it could be the same period
+        oldest_in_period = {}
+        for i in range(start - 1, end):
+            key = period_key(dates[i])
+            if key in oldest_in_period:
+                to_remove[oldest_in_period[key]] = True
+            oldest_in_period[key] = i
+
+    # remove all backups made before the oldest threshold
+    for i in range(bounds[4], len(all_backups)):
+        to_remove[i] = True
+
+    # removing is bound by unlink syscalls latency, so run it in parallel
+    with ThreadPoolExecutor(max_workers=RMTREE_WORKERS) as executor:
+        futures = []
+        for backup, do_delete in zip(all_backups, to_remove):
+            if do_delete:
+                if dry_run:
+                    _lg.info("Would remove old backup %s", backup.name)
+                else:
+                    _lg.info("Removing old backup %s", backup.name)
+                    futures.append(executor.submit(shutil.rmtree, backup.path))
+        for future in futures:
+            future.result()
 
-    for backup, do_delete in to_remove.items():
-        if do_delete:
-            if dry_run:
-                _lg.info("Would remove old backup %s", backup.name)
-            else:
-                _lg.info("Removing old backup %s", backup.name)
-                shutil.rmtree(backup.path)
+    if dry_run:
+        return tuple(backups)
+    return tuple(b for b, do_delete in zip(all_backups, to_remove)
+                 if not do_delete)[::-1]
 
 
 def process_backed_entry(backup_dir: str,
                          entry_relpath: str,
                          action: fs.Actions,
-                         msg: str):
+                         msg: str,
+                         delta_dir: Optional[str] = None):
     """
     Additional processing of backed up DirEntry (file/dir/symlink).
     Actions:
     - if DirEntry was not deleted, hardlink it to DELTA_DIR.
+    :param delta_dir: path to DELTA_DIR of the backup, calculated if not set.
     """
-    _lg.debug("%s %s %s", action, entry_relpath, msg)
-    if action not in (fs.Actions.ERROR, fs.Actions.DELETE):
+    # called for every backed up entry, skip packing args if not needed
+    if _lg.isEnabledFor(logging.DEBUG):
+        _lg.debug("%s %s %s", action, entry_relpath, msg)
+    if action not in _NOT_BACKED_ACTIONS:
+        if delta_dir is None:
+            delta_dir = os.path.join(backup_dir, DELTA_DIR)
         fs.nest_hardlink(src_dir=backup_dir, src_relpath=entry_relpath,
-                         dst_dir=os.path.join(backup_dir, DELTA_DIR))
+                         dst_dir=delta_dir)
+
+
+def _process_path_entries(backup_dir: str,
+                          entry_relpath: str,
+                          actions: Sequence[Tuple[fs.Actions, str]],
+                          delta_dir: str):
+    """ Run process_backed_entry for all (action, msg) of the same entry. """
+    for action, msg in actions:
+        process_backed_entry(backup_dir=backup_dir,
+                             entry_relpath=entry_relpath,
+                             action=action,
+                             msg=msg,
+                             delta_dir=delta_dir)
+
+
+def _process_backed_entries(executor: ThreadPoolExecutor,
+                            backup_dir: str,
+                            entries: Sequence[Tuple[str, fs.Actions, str]],
+                            delta_dir: str):
+    """
+    Run process_backed_entry for batch of (entry_relpath, action, msg)
+    in parallel, wait for all of them to finish.
+    Entry could be reported several times (e.g. both permissions and owner
+    are updated), such actions are processed sequentially by single task,
+    so the same entry is never processed concurrently.
+    """
+    path_actions = {}
+    for entry_relpath, action, msg in entries:
+        # external rsync reports directories with trailing separator
+        path_actions.setdefault(entry_relpath.rstrip(os.path.sep),
+                                []).append((action, msg))
+    batch = [executor.submit(_process_path_entries,
+                             backup_dir=backup_dir,
+                             entry_relpath=entry_relpath,
+                             actions=actions,
+                             delta_dir=delta_dir)
+             for entry_relpath, actions in path_actions.items()]
+    # raise the first error, if any
+    for future in batch:
+        future.result()
+
+
+def duplicate_source_names(sources: Iterable[str]) -> List[str]:
+    """ Return names of backup dirs shared by several sources. """
+    names = Counter(os.path.basename(os.path.abspath(src)) for src in sources)
+    return sorted(name for name, count in names.items() if count > 1)
 
 
 def initiate_backup(sources,
                     backups_dir: str,
                     dry_run: bool = False,
                     external_rsync: bool = False,
-                    external_hardlink: bool = False):
+                    external_hardlink: bool = False,
+                    backups: Optional[Sequence[os.DirEntry]] = None
+                    ) -> bool:
     """
     Main backup function.
     Creates a new backup directory, copies data from the latest backup,
     and then syncs data from sources.
+    Returns False if backup could not be created.
     :param sources: list of directories to backup (relative paths ok)
     :param backups_dir: directory where all backups are stored
     :param dry_run: if True, no actual changes will be made
     :param external_rsync: if True, use external rsync instead of python
     :param external_hardlink: if True, use external hardlink instead of python
+    :param backups: backups from snapshot_backups, scan backups_dir if not set
     """
 
-    start_time_fmt = datetime.now().strftime(BACKUP_ENT_FMT)
+    # every source is synced into backup dir named after it, sources are
+    # synced in parallel, so the same dir must not be shared by sources
+    duplicates = duplicate_source_names(sources)
+    if duplicates:
+        _lg.error("Sources have the same names, they can't be backed up"
+                  " together: %s", ", ".join(duplicates))
+        return False
+
+    # backup name is formatted directly from local time, no datetime needed
+    start_time_fmt = time.strftime(BACKUP_ENT_FMT, time.localtime())
     cur_backup = fs.PseudoDirEntry(os.path.join(backups_dir, start_time_fmt))
     _lg.debug("Current backup dir: %s", cur_backup.path)
 
-    latest_backup = _get_latest_backup(backups_dir)
+    latest_backup = _get_latest_backup(backups_dir, backups)
 
     if latest_backup is None:
         _lg.info("Creating empty directory for current backup: %s",
@@ -320,44 +508,68 @@ def initiate_backup(sources,
             _lg.error("Something went wrong during copying data from latest"
                       " backup, removing created %s", cur_backup.name)
             shutil.rmtree(cur_backup.path, ignore_errors=True)
-            return
+            return False
 
-        # remove backup markers from copied backup
-        for fname in os.listdir(cur_backup.path):
-            if fname.startswith(BACKUP_MARKER):
-                os.remove(os.path.join(cur_backup.path, fname))
+        # remove backup marker from copied backup, there is only one
+        with os.scandir(cur_backup.path) as it:
+            for ent in it:
+                if ent.name.startswith(BACKUP_MARKER):
+                    os.unlink(ent.path)
+                    break
 
         # clean up delta dir from copied backup
         shutil.rmtree(os.path.join(cur_backup.path, DELTA_DIR),
                       ignore_errors=True)
 
     rsync_func = fs.rsync_ext if external_rsync else fs.rsync
+    delta_dir = os.path.join(cur_backup.path, DELTA_DIR)
 
-    backup_changed = False
-    for src in sources:
+    def backup_source(src: str) -> bool:
+        """Sync single source into backup, return whether it changed."""
         src_abs = os.path.abspath(src)
         src_name = os.path.basename(src_abs)
+        src_prefix = src_name + os.path.sep
         dst_abs = os.path.join(cur_backup.path, src_name)
         _lg.info("Backing up directory %s to backup %s",
                  src_abs, cur_backup.name)
-        try:
-            for entry_relpath, action, msg in rsync_func(
-                    src_abs, dst_abs, dry_run=dry_run
-            ):
-                # TODO maybe should be run if first backup too?
-                if latest_backup is not None:
-                    process_backed_entry(
-                        backup_dir=cur_backup.path,
-                        entry_relpath=os.path.join(src_name, entry_relpath),
-                        action=action,
-                        msg=msg,
-                    )
-                # raise flag if something was changed since last backup
-                backup_changed = True
-        except fs.BackupCreationError as err:
-            _lg.error("Error during backup creation: %s", err)
-            _lg.error("Failed to create backup %s, removing", cur_backup.name)
-            shutil.rmtree(cur_backup.path, ignore_errors=True)
+        changed = False
+        backed_entries = []
+        for entry_relpath, action, msg in rsync_func(
+                src_abs, dst_abs, dry_run=dry_run
+        ):
+            # TODO maybe should be run if first backup too?
+            if latest_backup is not None:
+                backed_entries.append((src_prefix + entry_relpath,
+                                       action, msg))
+                if len(backed_entries) >= PROCESS_BATCH_SIZE:
+                    _process_backed_entries(process_executor,
+                                            cur_backup.path,
+                                            backed_entries, delta_dir)
+                    backed_entries = []
+            # raise flag if something was changed since last backup
+            changed = True
+        _process_backed_entries(process_executor, cur_backup.path,
+                                backed_entries, delta_dir)
+        return changed
+
+    # sources are independent, so they are synced in parallel
+    backup_changed = False
+    backup_failed = False
+    process_executor = ThreadPoolExecutor(max_workers=PROCESS_WORKERS)
+    with process_executor, \
+            ThreadPoolExecutor(max_workers=len(sources) or 1) as executor:
+        for future in [executor.submit(backup_source, src)
+                       for src in sources]:
+            try:
+                backup_changed |= future.result()
+            except fs.BackupCreationError as err:
+                _lg.error("Error during backup creation: %s", err)
+                backup_failed = True
+
+    if backup_failed:
+        _lg.error("Failed to create backup %s, removing", cur_backup.name)
+        shutil.rmtree(cur_backup.path, ignore_errors=True)
+        return False
 
     # do not create backup on dry-run
     if dry_run:
@@ -371,3 +583,4 @@ def initiate_backup(sources,
     else:
         set_backup_marker(cur_backup)
         _lg.info("Backup created: %s", cur_backup.name)
+    return True
@@ -8,7 +8,7 @@ import sys
 import time
 from datetime import timedelta
 
-from curateipsum import backup
+from curateipsum import backup, fs
 from curateipsum._version import version
 
 _lg = logging.getLogger("curateipsum")
@@ -91,24 +91,31 @@ def main():
             _lg.error("Source directory %s does not exist", src_dir)
             return 1
 
-    start_time = time.time()
+    start_time = time.monotonic()
+    fs.raise_open_files_limit()
 
     if not backup.set_backups_lock(backups_dir_abs, args.force):
         return 1
 
     # TODO add cleaning up from non-finished backups
-    backup.cleanup_old_backups(backups_dir=backups_dir_abs,
-                               dry_run=args.dry_run)
-    backup.initiate_backup(
+    backups = backup.snapshot_backups(backups_dir_abs)
+    # cleanup could remove the latest backup, so use backups left after it
+    backups = backup.cleanup_old_backups(backups_dir=backups_dir_abs,
+                                         dry_run=args.dry_run,
+                                         backups=backups)
+    backup_ok = backup.initiate_backup(
         sources=args.sources,
         backups_dir=backups_dir_abs,
         dry_run=args.dry_run,
         external_rsync=args.external_rsync,
         external_hardlink=args.external_hardlink,
+        backups=backups,
     )
     backup.release_backups_lock(backups_dir_abs)
+    if not backup_ok:
+        return 1
 
-    end_time = time.time()
+    end_time = time.monotonic()
     spent_time = end_time - start_time
     _lg.info("Finished, time spent: %s", str(timedelta(seconds=spent_time)))
 
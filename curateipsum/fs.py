@@ -3,13 +3,49 @@ Module with filesystem-related functions.
 """
 
 import enum
-import glob
+import errno
 import logging
+import mmap
 import os
+import queue
+import shutil
+import stat
 import subprocess
 import sys
-from typing import Iterable, Tuple, Union
+import threading
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple, Union
 
+try:
+    import fcntl
+    import resource
+except ImportError:  # Windows
+    fcntl = None
+    resource = None
+
+# threads for scanning directories and min amount of top-level directories
+# when it's worth to scan them in parallel
+SCAN_WORKERS = 8
+PARALLEL_SCAN_MIN_DIRS = 4
+# entries scanned ahead of caller, when directories are yielded after content
+SCAN_READ_AHEAD = 1024
+# threads for copying new files in rsync and min amount of new files
+# when it's worth to copy them in parallel
+COPY_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+PARALLEL_COPY_MIN_FILES = 64
+# threads for hardlinking directories
+HARDLINK_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# open files limit to set when hard limit is unlimited
+MAX_OPEN_FILES = 10240
+# length of change string in rsync --itemize-changes output
+RSYNC_ITEMIZE_LEN = 11
+# rsync output is read by chunks of pipe capacity, pipe is enlarged to
+# RSYNC_PIPE_SIZE where possible (Linux only)
+RSYNC_PIPE_SIZE = 1024 * 1024
+RSYNC_READ_SIZE = RSYNC_PIPE_SIZE
+# chunks of rsync output read ahead, while caller processes previous ones
+RSYNC_READ_AHEAD = 4
 _lg = logging.getLogger(__name__)
 
 
@@ -29,65 +65,167 @@ class Actions(enum.Enum):
 
 
 class PseudoDirEntry:
+    """
+    os.DirEntry-like object for arbitrary path.
+    All type checks are answered from a single cached lstat call,
+    stat of symlink target is requested only when following symlinks.
+    """
     def __init__(self, path):
         self.path = os.path.realpath(path)
         self.name = os.path.basename(self.path)
-        self._is_dir = None
-        self._is_file = None
-        self._is_symlink = None
+        self._lstat = None
         self._stat = None
 
     def __str__(self):
         return self.name
 
+    def _mode(self, follow_symlinks: bool) -> Optional[int]:
+        try:
+            return self.stat(follow_symlinks=follow_symlinks).st_mode
+        except OSError:
+            return None
+
     def is_dir(self, follow_symlinks: bool = True) -> bool:
-        if self._is_dir is None:
-            self._is_dir = os.path.isdir(self.path)
-        return self._is_dir
+        mode = self._mode(follow_symlinks)
+        return mode is not None and stat.S_ISDIR(mode)
 
     def is_file(self, follow_symlinks: bool = True) -> bool:
-        if self._is_file is None:
-            self._is_file = os.path.isfile(self.path)
-        return self._is_file
+        mode = self._mode(follow_symlinks)
+        return mode is not None and stat.S_ISREG(mode)
 
-    def is_symlink(self, follow_symlinks: bool = True) -> bool:
-        if self._is_symlink is None:
-            self._is_symlink = os.path.islink(self.path)
-        return self._is_symlink
+    def is_symlink(self) -> bool:
+        mode = self._mode(follow_symlinks=False)
+        return mode is not None and stat.S_ISLNK(mode)
 
     def stat(self, follow_symlinks: bool = True):
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        if not follow_symlinks or not stat.S_ISLNK(self._lstat.st_mode):
+            return self._lstat
         if self._stat is None:
-            func = os.stat if follow_symlinks else os.lstat
-            self._stat = func(self.path)
+            self._stat = os.stat(self.path)
         return self._stat
 
 
-def _parse_rsync_output(line: str) -> Tuple[str, Actions, str]:
-    action = None
-    change_string, relpath = line.split(' ', maxsplit=1)
-    if change_string == "*deleting":
-        return relpath, Actions.DELETE, ""
+def _rsync_action(change_string: bytes) -> Optional[Actions]:
+    """ Get action for rsync --itemize-changes change string. """
+    if change_string.startswith(b"*deleting"):
+        return Actions.DELETE
 
-    update_type = change_string[0]
-    entity_type = change_string[1]
+    update_type = change_string[0:1]
+    entity_type = change_string[1:2]
     change_type = change_string[2:]
 
-    if update_type == "c" and entity_type in {"d", "L"} and "+" in change_type:
-        action = Actions.CREATE
-    elif update_type == ">" and entity_type == "f" and "+" in change_type:
-        action = Actions.CREATE
-    elif entity_type == "f" and ("s" in change_type or "t" in change_type):
-        action = Actions.REWRITE
-    elif entity_type == "d" and "t" in change_type:
-        action = Actions.UPDATE_TIME
-    elif "p" in change_type:
-        action = Actions.UPDATE_PERM
-    elif "o" in change_type or "g" in change_type:
-        action = Actions.UPDATE_OWNER
+    if (update_type == b"c" and entity_type in (b"d", b"L")
+            and b"+" in change_type):
+        return Actions.CREATE
+    if update_type == b">" and entity_type == b"f" and b"+" in change_type:
+        return Actions.CREATE
+    if entity_type == b"f" and (b"s" in change_type or b"t" in change_type):
+        return Actions.REWRITE
+    if entity_type == b"d" and b"t" in change_type:
+        return Actions.UPDATE_TIME
+    if b"p" in change_type:
+        return Actions.UPDATE_PERM
+    if b"o" in change_type or b"g" in change_type:
+        return Actions.UPDATE_OWNER
+    return None
+
 
+# actions by change strings met in rsync output; there are few distinct
+# change strings, so each of them is parsed only once
+_RSYNC_ACTIONS = {}
+
+
+def _parse_rsync_output(line: bytes) -> Tuple[str, Actions, str]:
+    """
+    Parse rsync --itemize-changes line: 11-char change string, space, path.
+    Only the path is decoded, change string is looked up as bytes.
+    """
+    change_string = line[:RSYNC_ITEMIZE_LEN]
+    action = _RSYNC_ACTIONS.get(change_string)
     if action is None:
-        raise RuntimeError("Not parsed string: %s" % line)
-    return relpath, action, ""
+        action = _rsync_action(change_string)
+        if action is None:
+            raise RuntimeError("Not parsed string: %r" % line)
+        _RSYNC_ACTIONS[change_string] = action
+    return line[RSYNC_ITEMIZE_LEN + 1:].decode("utf-8"), action, ""
+
+
+def _put_until_stopped(items: queue.Queue, item,
+                       stopped: threading.Event) -> bool:
+    """
+    Put item into bounded queue, waiting for free slot until stopped is set.
+    Return False if item was not put, so producer doesn't block forever if
+    consumer stopped getting items.
+    """
+    while not stopped.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _read_chunks(stream, chunk_size: int,
+                 read_ahead: int = RSYNC_READ_AHEAD) -> Iterable[bytes]:
+    """
+    Yield big chunks of binary stream, read in background thread.
+    Stream is drained while caller processes already read data,
+    so writing process doesn't wait for the caller. Only read_ahead chunks
+    are kept in memory, reading is paused if caller is slower than writer.
+    """
+    chunks = queue.Queue(maxsize=read_ahead)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        return _put_until_stopped(chunks, item, stopped)
+
+    def reader():
+        try:
+            for chunk in iter(lambda: stream.read1(chunk_size), b""):
+                if not put(chunk):
+                    return
+        except (OSError, ValueError) as exc:
+            # ValueError is raised if stream is closed by caller
+            put(exc)
+        put(None)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        for chunk in iter(chunks.get, None):
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        stopped.set()
+    thread.join()
+
+
+def _iter_lines(stream, chunk_size: int) -> Iterable[bytes]:
+    """ Yield lines from binary stream, reading it by big chunks. """
+    tail = b""
+    for chunk in _read_chunks(stream, chunk_size):
+        *lines, tail = (tail + chunk).split(b"\n")
+        yield from lines
+    if tail:
+        yield tail
+
+
+def _set_pipe_size(stream, size: int):
+    """
+    Enlarge pipe buffer, so writing process blocks less often on full pipe.
+    Not all platforms support it, and size may exceed system limit for
+    unprivileged users, pipe is left as is then.
+    """
+    if getattr(fcntl, "F_SETPIPE_SZ", None) is None:
+        return
+    try:
+        fcntl.fcntl(stream.fileno(), fcntl.F_SETPIPE_SZ, size)
+    except OSError as exc:
+        _lg.debug("Can't set pipe size to %s: %s", size, exc)
 
 
 def rsync_ext(src, dst, dry_run=False) -> Iterable[Tuple[str, Actions, str]]:
@@ -112,31 +250,20 @@ def rsync_ext(src, dst, dry_run=False) -> Iterable[Tuple[str, Actions, str]]:
     process = subprocess.Popen(rsync_args,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.STDOUT)
+    _set_pipe_size(process.stdout, RSYNC_PIPE_SIZE)
+    # called for every line of output, skip packing args if not needed
+    log_debug = _lg.isEnabledFor(logging.DEBUG)
     with process.stdout:
-        prev_line = None
-        for line in iter(process.stdout.readline, b""):
-            _lg.debug("Rsync current line: %s", line)
-            if prev_line is None:
-                prev_line = line
+        for line in _iter_lines(process.stdout, RSYNC_READ_SIZE):
+            if not line:
                 continue
-
+            if log_debug:
+                _lg.debug("Rsync itemize line: %r", line)
             try:
-                prev_line = prev_line.decode("utf-8").strip()
+                yield _parse_rsync_output(line)
             # some issues with cyrillic in filenames
             except UnicodeDecodeError:
-                _lg.error("Can't process rsync line: %s", prev_line)
-                continue
-            _lg.debug("Rsync itemize line: %s", prev_line)
-            yield _parse_rsync_output(prev_line)
-            prev_line = line
-
-        try:
-            prev_line = prev_line.decode("utf-8").strip()
-            _lg.debug("Rsync itemize line: %s", prev_line)
-            yield _parse_rsync_output(prev_line)
-        # some issues with cyrillic in filenames
-        except UnicodeDecodeError:
-            _lg.error("Can't process rsync line: %s", prev_line)
+                _lg.error("Can't process rsync line: %r", line)
 
     process.wait()
 
@@ -145,17 +272,202 @@ def scantree(path, dir_first=True) -> Iterable[os.DirEntry]:
     """
     Recursively yield DirEntry objects (dir/file/symlink) for given directory.
     """
+    # stack of (scandir iterator, its dir entry) instead of recursion,
+    # so every subdirectory doesn't add a nested generator to go through
+    stack = [(os.scandir(path), None)]
     entry: os.DirEntry
+    try:
+        while stack:
+            scan_it, dir_entry = stack[-1]
+            for entry in scan_it:
+                if entry.is_dir(follow_symlinks=False):
+                    if dir_first:
+                        yield entry
+                    stack.append((os.scandir(entry.path), entry))
+                    break
+                yield entry
+            else:
+                scan_it.close()
+                stack.pop()
+                if dir_entry is not None and not dir_first:
+                    yield dir_entry
+    finally:
+        for scan_it, _ in stack:
+            scan_it.close()
+
+
+def _stat_entries(entries: List[os.DirEntry]):
+    """ Cache lstat of entries in DirEntry objects. """
+    for entry in entries:
+        try:
+            entry.stat(follow_symlinks=False)
+        except OSError:
+            # entry is gone, error is raised again on later stat
+            pass
+
+
+def _scandir_list(path, stat_entries=False) -> List[os.DirEntry]:
+    """
+    Return list of DirEntry objects for given directory.
+    If stat_entries is True, lstat of entries is cached in DirEntry objects.
+    """
     with os.scandir(path) as scan_it:
-        for entry in scan_it:
+        entries = list(scan_it)
+    if stat_entries:
+        _stat_entries(entries)
+    return entries
+
+
+def _scan_content_first(dir_entry: os.DirEntry,
+                        stat_entries: bool,
+                        put: Callable[[os.DirEntry], bool]) -> bool:
+    """
+    Pass DirEntry objects of directory tree to put(), every directory after
+    its content, dir_entry itself goes last. Directory is listed completely
+    before its entries are passed, so caller could change them meanwhile.
+    Only listings of directories on the current path are kept in memory.
+    Return False if put() refused an entry.
+    """
+    # stack of (iterator over directory listing, its dir entry)
+    stack = [(iter(_scandir_list(dir_entry.path, stat_entries)), dir_entry)]
+    while stack:
+        entries_it, cur_dir = stack[-1]
+        for entry in entries_it:
             if entry.is_dir(follow_symlinks=False):
-                if dir_first:
+                stack.append((iter(_scandir_list(entry.path, stat_entries)),
+                              entry))
+                break
+            if not put(entry):
+                return False
+        else:
+            stack.pop()
+            if not put(cur_dir):
+                return False
+    return True
+
+
+def _scantree_parallel_content_first(path,
+                                     workers: int,
+                                     stat_entries: bool
+                                     ) -> Iterable[os.DirEntry]:
+    """
+    Yield DirEntry objects of given directory tree, every directory after its
+    content. Subtrees of top-level directories are scanned in a thread pool
+    and their entries are streamed through a queue of SCAN_READ_AHEAD
+    entries, so neither whole tree nor whole subtree is kept in memory.
+    """
+    top_entries = _scandir_list(path, stat_entries)
+    subdirs = []
+    for entry in top_entries:
+        if entry.is_dir(follow_symlinks=False):
+            subdirs.append(entry)
+        else:
+            yield entry
+
+    if len(subdirs) <= PARALLEL_SCAN_MIN_DIRS:
+        for subdir in subdirs:
+            yield from scantree(subdir.path, dir_first=False)
+            yield subdir
+        return
+
+    # entries of different subtrees are interleaved in the queue, every
+    # scanning task puts None when finished
+    entries = queue.Queue(maxsize=SCAN_READ_AHEAD)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        return _put_until_stopped(entries, item, stopped)
+
+    def scan(subdir: os.DirEntry):
+        try:
+            if not stopped.is_set():
+                _scan_content_first(subdir, stat_entries, put)
+        except Exception as exc:
+            put(exc)
+        finally:
+            put(None)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for subdir in subdirs:
+            executor.submit(scan, subdir)
+        try:
+            scanning = len(subdirs)
+            while scanning:
+                entry = entries.get()
+                if entry is None:
+                    scanning -= 1
+                elif isinstance(entry, Exception):
+                    raise entry
+                else:
                     yield entry
-                yield from scantree(entry.path, dir_first)
-                if not dir_first:
+        finally:
+            # let tasks left finish quickly if caller stopped early
+            stopped.set()
+
+
+def scantree_parallel(path,
+                      workers: int = SCAN_WORKERS,
+                      stat_entries=False,
+                      dir_first=True) -> Iterable[os.DirEntry]:
+    """
+    Recursively yield DirEntry objects (dir/file/symlink) for given directory,
+    scanning subdirectories in a thread pool to overlap syscalls latency.
+    Order of entries differs from scantree, but directory is yielded before
+    or after its content depending on dir_first, same as in scantree.
+    If stat_entries is True, entries are also stat'ed in the pool, so their
+    stat() calls are answered from DirEntry cache.
+    Falls back to scantree if there are too few subdirectories in path.
+    """
+    if not dir_first:
+        yield from _scantree_parallel_content_first(path, workers,
+                                                    stat_entries)
+        return
+
+    top_entries = _scandir_list(path, stat_entries)
+    subdirs = [ent for ent in top_entries if ent.is_dir(follow_symlinks=False)]
+    if len(subdirs) <= PARALLEL_SCAN_MIN_DIRS:
+        for entry in top_entries:
+            yield entry
+            if entry.is_dir(follow_symlinks=False):
+                yield from scantree(entry.path, dir_first=True)
+        return
+
+    yield from top_entries
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(_scandir_list, d.path, stat_entries)
+                   for d in subdirs}
+        while pending:
+            done, pending = futures.wait(pending,
+                                         return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                for entry in future.result():
                     yield entry
-            else:
-                yield entry
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.add(executor.submit(_scandir_list,
+                                                    entry.path,
+                                                    stat_entries))
+
+
+def raise_open_files_limit():
+    """
+    Raise soft limit of open files up to hard limit, so parallel scanning
+    and copying don't run out of file descriptors on systems with low
+    default soft limit.
+    """
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    # unlimited hard limit is not accepted as soft one on macOS
+    new_soft = MAX_OPEN_FILES if hard == resource.RLIM_INFINITY else hard
+    if soft == resource.RLIM_INFINITY or soft >= new_soft:
+        return
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+    except (ValueError, OSError) as exc:
+        _lg.debug("Failed to raise open files limit to %s: %s",
+                  new_soft, exc)
+        return
+    _lg.debug("Open files limit raised: %s -> %s", soft, new_soft)
 
 
 def rm_direntry(entry: Union[os.DirEntry, PseudoDirEntry]):
@@ -163,11 +475,16 @@ def rm_direntry(entry: Union[os.DirEntry, PseudoDirEntry]):
     if entry.is_file(follow_symlinks=False) or entry.is_symlink():
         os.unlink(entry.path)
     elif entry.is_dir(follow_symlinks=False):
-        with os.scandir(entry.path) as it:
-            child_entry: os.DirEntry
-            for child_entry in it:
-                rm_direntry(child_entry)
-        os.rmdir(entry.path)
+        # rsync deletes dir content before the dir, so dir is usually empty
+        try:
+            os.rmdir(entry.path)
+            return
+        except OSError as exc:
+            if exc.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+        # rmtree removes entries relative to opened dirs where possible,
+        # without resolving full path of every entry
+        shutil.rmtree(entry.path)
 
 
 try:
@@ -176,17 +493,215 @@ except AttributeError:
     O_BINARY = 0
 READ_FLAGS = os.O_RDONLY | O_BINARY
 WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY
-BUFFER_SIZE = 128 * 1024
+# userspace copy buffer sizes by amount of physical memory
+_BUFFER_SIZES = (
+    (512 * 1024 * 1024, 32 * 1024),
+    (4 * 1024 * 1024 * 1024, 128 * 1024),
+    (32 * 1024 * 1024 * 1024, 512 * 1024),
+)
+_MAX_BUFFER_SIZE = 1024 * 1024
 
 
-def copy_file(src, dst):
-    """ Copy file from src to dst. Faster than shutil.copy. """
+def _get_buffer_size() -> int:
+    """ Get userspace copy buffer size, scaled with physical memory size. """
+    try:
+        phys_mem = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        # no sysconf on Windows
+        return 128 * 1024
+    for mem_limit, buf_size in _BUFFER_SIZES:
+        if phys_mem < mem_limit:
+            return buf_size
+    return _MAX_BUFFER_SIZE
+
+
+BUFFER_SIZE = _get_buffer_size()
+# max bytes per single in-kernel copy syscall
+KERNEL_COPY_SIZE = 1024 * 1024 * 1024
+# min file size to copy it through memory mapping instead of read buffer
+MMAP_COPY_MIN_SIZE = 1024 * 1024
+# min file size to give kernel access pattern hints for buffered copy
+FADVISE_MIN_SIZE = 64 * 1024
+_FADVISE = hasattr(os, "posix_fadvise")
+# whether hardlinks and directories can be created relative to
+# opened directories
+_LINK_DIR_FD = (hasattr(os, "O_DIRECTORY")
+                and os.link in os.supports_dir_fd
+                and os.link in os.supports_follow_symlinks
+                and os.mkdir in os.supports_dir_fd)
+# whether attributes of entries can be changed relative to opened directory
+_META_DIR_FD = (hasattr(os, "O_DIRECTORY")
+                and os.chown in os.supports_dir_fd
+                and os.chmod in os.supports_dir_fd
+                and os.utime in os.supports_dir_fd)
+_DIR_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0)
+# source directory is used only as a base for paths (Linux only flag)
+_SRC_DIR_FLAGS = _DIR_FLAGS | getattr(os, "O_PATH", 0)
+# whether symlink attributes can be changed, depends on OS
+_CHOWN_NOFOLLOW = os.chown in os.supports_follow_symlinks
+_CHMOD_NOFOLLOW = os.chmod in os.supports_follow_symlinks
+_UTIME_NOFOLLOW = os.utime in os.supports_follow_symlinks
+# per-thread userspace copy buffer, reused between copies
+_copy_buffer = threading.local()
+
+
+def _get_copy_buffer() -> memoryview:
+    """ Get copy buffer of BUFFER_SIZE bytes for the current thread. """
+    buf = getattr(_copy_buffer, "buf", None)
+    if buf is None or len(buf) != BUFFER_SIZE:
+        buf = _copy_buffer.buf = memoryview(bytearray(BUFFER_SIZE))
+    return buf
+
+
+def _copy_file_range(fin: int, fout: int, size: int) -> int:
+    """ Copy data between file descriptors inside the kernel. """
+    copied = 0
+    while True:
+        chunk = os.copy_file_range(fin, fout, KERNEL_COPY_SIZE)
+        if not chunk:
+            return copied
+        copied += chunk
+
+
+def _copy_sendfile(fin: int, fout: int, size: int) -> int:
+    """ Copy data between file descriptors with sendfile (Linux only). """
+    copied = 0
+    while True:
+        chunk = os.sendfile(fout, fin, None, KERNEL_COPY_SIZE)
+        if not chunk:
+            return copied
+        copied += chunk
+
+
+def _copy_buffered(fin: int, fout: int, size: int) -> int:
+    """
+    Copy data between file descriptors through userspace buffer.
+    :param size: expected data size, buffer is not allocated larger than it.
+    """
+    buf_size = min(BUFFER_SIZE, size) or BUFFER_SIZE
+    copied = 0
+    if not hasattr(os, "readv"):
+        # no readv on Windows, read into new bytes object every time
+        for x in iter(lambda: os.read(fin, buf_size), b""):
+            copied += os.write(fout, x)
+        return copied
+
+    # ask kernel for aggressive readahead, and drop copied data from page
+    # cache afterwards, so backup doesn't evict data used by others
+    fadvise = _FADVISE and size >= FADVISE_MIN_SIZE
+    if fadvise:
+        os.posix_fadvise(fin, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    buf = _get_copy_buffer()[:buf_size]
+    while True:
+        read = os.readv(fin, [buf])
+        if not read:
+            break
+        copied += os.write(fout, buf[:read])
+
+    if fadvise:
+        os.posix_fadvise(fin, 0, 0, os.POSIX_FADV_DONTNEED)
+        os.posix_fadvise(fout, 0, 0, os.POSIX_FADV_DONTNEED)
+    return copied
+
+
+def _copy_mmap(fin: int, fout: int, size: int) -> int:
+    """
+    Copy data between file descriptors through memory mapping of source,
+    so data is written directly from page cache. Small files and files,
+    which can't be mapped, are copied through userspace buffer.
+    """
+    if size < MMAP_COPY_MIN_SIZE:
+        return _copy_buffered(fin, fout, size)
+    try:
+        mm = mmap.mmap(fin, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as exc:
+        _lg.debug("Copy, mmap failed (%s), falling back to read buffer", exc)
+        return _copy_buffered(fin, fout, size)
+
+    with mm, memoryview(mm) as view:
+        if hasattr(mm, "madvise"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        start = offset = os.lseek(fin, 0, os.SEEK_CUR)
+        while offset < len(view):
+            offset += os.write(fout, view[offset:offset + BUFFER_SIZE])
+    return offset - start
+
+
+# copy functions from the fastest, next one is used if previous is not
+# supported for given files; all of them continue from current file offsets,
+# take expected size of data to copy and return size of copied data
+_COPY_FUNCS = []
+if hasattr(os, "copy_file_range"):
+    _COPY_FUNCS.append(_copy_file_range)
+if sys.platform.startswith("linux"):
+    _COPY_FUNCS.append(_copy_sendfile)
+if sys.platform != "win32":
+    _COPY_FUNCS.append(_copy_mmap)
+else:
+    _COPY_FUNCS.append(_copy_buffered)
+# hardlink errors, after which entry is copied instead: too many links
+# to source inode or source and destination are on different filesystems
+_LINK_FALLBACK_ERRNOS = frozenset((errno.EMLINK, errno.EXDEV))
+
+
+def _disable_copy_func(copy_func):
+    """
+    Don't try copy function for next files, if it is not implemented
+    by kernel at all. Other errors depend on particular files.
+    """
+    global _COPY_FUNCS
+    if copy_func in _COPY_FUNCS:
+        _lg.debug("Copy, %s is not supported, disabling it",
+                  copy_func.__name__)
+        _COPY_FUNCS = [f for f in _COPY_FUNCS if f is not copy_func]
+
+
+def copy_file(src, dst, copy_stat: bool = False):
+    """
+    Copy file from src to dst. Faster than shutil.copy.
+    :param copy_stat: also copy owner, permissions and times of src. They are
+        set through opened dst descriptor, without resolving dst path again.
+    """
     try:
         fin = os.open(src, READ_FLAGS)
         fstat = os.fstat(fin)
         fout = os.open(dst, WRITE_FLAGS, fstat.st_mode)
-        for x in iter(lambda: os.read(fin, BUFFER_SIZE), b""):
-            os.write(fout, x)
+        # nothing to copy for empty files
+        copy_funcs = _COPY_FUNCS if fstat.st_size else ()
+        for copy_func in copy_funcs:
+            # like shutil, next function is tried on any error or if nothing
+            # is copied (some filesystems report zero for kernel copy), but
+            # only while nothing is written to dst yet
+            try:
+                if copy_func(fin, fout, fstat.st_size):
+                    break
+                if copy_func is copy_funcs[-1]:
+                    break
+                _lg.debug("Copy, %s copied nothing, falling back: %s",
+                          copy_func.__name__, src)
+            except OSError as exc:
+                if (copy_func is copy_funcs[-1]
+                        or os.lseek(fout, 0, os.SEEK_CUR)):
+                    raise
+                _lg.debug("Copy, %s failed (%s), falling back: %s",
+                          copy_func.__name__, exc, src)
+                if exc.errno == errno.ENOSYS:
+                    _disable_copy_func(copy_func)
+            # failed function could have read some data
+            os.lseek(fin, 0, os.SEEK_SET)
+        if copy_stat:
+            # owner and permissions are often right already (file created
+            # by its owner with default umask), skip updating them then
+            dst_stat = os.fstat(fout)
+            chowned = (dst_stat.st_uid != fstat.st_uid
+                       or dst_stat.st_gid != fstat.st_gid)
+            if chowned:
+                os.fchown(fout, fstat.st_uid, fstat.st_gid)
+            # chown may reset setuid/setgid bits, so mode is set after it
+            if chowned or dst_stat.st_mode != fstat.st_mode:
+                os.fchmod(fout, fstat.st_mode)
+            os.utime(fout, ns=(fstat.st_atime_ns, fstat.st_mtime_ns))
     finally:
         try:
             os.close(fout)
@@ -201,30 +716,34 @@ def copy_file(src, dst):
 def copy_direntry(entry: Union[os.DirEntry, PseudoDirEntry], dst_path):
     """ Non-recursive DirEntry (file/dir/symlink) copy. """
     src_stat = entry.stat(follow_symlinks=False)
-    if entry.is_dir():
+    is_symlink = stat.S_ISLNK(src_stat.st_mode)
+    if stat.S_ISDIR(src_stat.st_mode):
         os.mkdir(dst_path)
 
-    elif entry.is_symlink():
+    elif is_symlink:
         link_target = os.readlink(entry.path)
         os.symlink(link_target, dst_path)
 
     else:
-        copy_file(entry.path, dst_path)
+        # file attributes are set by copy_file via its opened descriptor
+        copy_file(entry.path, dst_path, copy_stat=True)
+        return
 
-    if entry.is_symlink():
+    if is_symlink:
         # change symlink attributes only if supported by OS
-        if os.chown in os.supports_follow_symlinks:
+        if _CHOWN_NOFOLLOW:
             os.chown(dst_path, src_stat.st_uid, src_stat.st_gid,
                      follow_symlinks=False)
-        if os.chmod in os.supports_follow_symlinks:
+        if _CHMOD_NOFOLLOW:
             os.chmod(dst_path, src_stat.st_mode, follow_symlinks=False)
-        if os.utime in os.supports_follow_symlinks:
-            os.utime(dst_path, (src_stat.st_atime, src_stat.st_mtime),
+        if _UTIME_NOFOLLOW:
+            os.utime(dst_path,
+                     ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns),
                      follow_symlinks=False)
     else:
         os.chown(dst_path, src_stat.st_uid, src_stat.st_gid)
         os.chmod(dst_path, src_stat.st_mode)
-        os.utime(dst_path, (src_stat.st_atime, src_stat.st_mtime))
+        os.utime(dst_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
 
 
 def update_direntry(src_entry: os.DirEntry, dst_entry: os.DirEntry):
@@ -237,6 +756,109 @@ def update_direntry(src_entry: os.DirEntry, dst_entry: os.DirEntry):
     copy_direntry(src_entry, dst_entry.path)
 
 
+# file types, which dst entry is rewritten to, if its type is different
+_SYNCED_TYPES = frozenset((stat.S_IFREG, stat.S_IFDIR, stat.S_IFLNK))
+
+
+def _file_rewrite_reason(src_entry: os.DirEntry, dst_entry: os.DirEntry,
+                         src_stat: os.stat_result,
+                         dst_stat: os.stat_result) -> Optional[str]:
+    """ Rewrite dst file which has different mtime or size than src. """
+    # changed files almost always have new mtime, so it's checked first;
+    # backups made before mtimes were copied with ns precision got them
+    # through float utime, which loses last digits of ns, such mtimes are
+    # still equal as floats
+    if (src_stat.st_mtime_ns != dst_stat.st_mtime_ns
+            and src_stat.st_mtime != dst_stat.st_mtime):
+        return "different time"
+    if src_stat.st_size != dst_stat.st_size:
+        return "different size"
+    return None
+
+
+def _symlink_rewrite_reason(src_entry: os.DirEntry, dst_entry: os.DirEntry,
+                            src_stat: os.stat_result,
+                            dst_stat: os.stat_result) -> Optional[str]:
+    """ Rewrite dst symlink if it points somewhere else than src. """
+    if os.readlink(src_entry.path) != os.readlink(dst_entry.path):
+        return "different symlink target"
+    return None
+
+
+# type-specific checks of entries with same type, dirs have no such check
+_REWRITE_CHECKS = {
+    stat.S_IFREG: _file_rewrite_reason,
+    stat.S_IFLNK: _symlink_rewrite_reason,
+}
+
+
+def _rewrite_reason(src_entry: os.DirEntry, dst_entry: os.DirEntry,
+                    src_stat: os.stat_result,
+                    dst_stat: os.stat_result) -> Optional[str]:
+    """
+    Check whether existing dst entry should be rewritten by src entry.
+    :return: reason for rewriting or None, if dst could be updated in place.
+    """
+    src_mode = src_stat.st_mode
+    dst_mode = dst_stat.st_mode
+
+    # rewrite dst if it has different type from src (file/dir/symlink),
+    # file type bits of both modes are compared at once
+    src_type = stat.S_IFMT(src_mode)
+    if src_type != stat.S_IFMT(dst_mode) and src_type in _SYNCED_TYPES:
+        return "different type"
+
+    # rewrite dst if it is hard link to src (bad for backups), inode numbers
+    # are comparable only on the same filesystem
+    if (src_stat.st_ino == dst_stat.st_ino
+            and src_stat.st_dev == dst_stat.st_dev):
+        return "different inodes"
+
+    # entries of same type are compared by type-specific function
+    check_func = _REWRITE_CHECKS.get(src_type)
+    if check_func is None:
+        return None
+    return check_func(src_entry, dst_entry, src_stat, dst_stat)
+
+
+def _copy_new_files(
+        new_files: List[Tuple[str, os.DirEntry, str]],
+        workers: int = COPY_WORKERS,
+) -> Iterable[Tuple[str, Actions, str]]:
+    """
+    Copy new (not directory) entries into existing directories.
+    Copying is done in parallel if there are enough entries, results are
+    yielded in order of completion.
+    :param new_files: list of (rel_path, source entry, destination path).
+    """
+    log_debug = _lg.isEnabledFor(logging.DEBUG)
+    if len(new_files) < PARALLEL_COPY_MIN_FILES:
+        for rel_path, src_entry, dst_path in new_files:
+            if log_debug:
+                _lg.debug("Rsync, creating: %s", rel_path)
+            try:
+                copy_direntry(src_entry, dst_path)
+                yield rel_path, Actions.CREATE, ""
+            except OSError as exc:
+                yield rel_path, Actions.ERROR, str(exc)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {
+            executor.submit(copy_direntry, src_entry, dst_path): rel_path
+            for rel_path, src_entry, dst_path in new_files
+        }
+        for future in futures.as_completed(pending):
+            rel_path = pending[future]
+            if log_debug:
+                _lg.debug("Rsync, creating: %s", rel_path)
+            try:
+                future.result()
+                yield rel_path, Actions.CREATE, ""
+            except OSError as exc:
+                yield rel_path, Actions.ERROR, str(exc)
+
+
 def rsync(src_dir,
           dst_dir,
           dry_run=False) -> Iterable[Tuple[str, Actions, str]]:
@@ -255,28 +877,54 @@ def rsync(src_dir,
         raise BackupCreationError(
             "Error during reading source directory: %s" % src_root_abs
         )
-    if os.path.exists(dst_root_abs):
-        if not os.path.isdir(dst_root_abs):
+    # dst usually exists (hardlinked previous backup), so it's checked
+    # with single stat call
+    try:
+        dst_root_stat = os.stat(dst_root_abs)
+    except FileNotFoundError:
+        os.mkdir(dst_root_abs)
+    else:
+        if not stat.S_ISDIR(dst_root_stat.st_mode):
             raise BackupCreationError(
                 "Destination path is not a directory: %s" % dst_root_abs
             )
-    else:
-        os.mkdir(dst_root_abs)
 
-    # Create source map {rel_path: dir_entry}
-    src_files_map = {
-        ent.path[len(src_root_abs) + 1:]: ent for ent in scantree(src_root_abs)
-    }
+    # Create source map {rel_path: dir_entry} and list of source dirs
+    # in single scan, source dirs are needed to restore their mtimes in dst
+    src_files_map = {}
+    src_dirs = []
+    # length of root prefix (with separator) to cut from entry paths
+    src_strip = len(src_root_abs) + 1
+    for ent in scantree_parallel(src_root_abs, stat_entries=True):
+        rel_path = ent.path[src_strip:]
+        src_files_map[rel_path] = ent
+        # type is known from scandir without stat
+        if ent.is_dir(follow_symlinks=False):
+            src_dirs.append((rel_path, ent))
+
+    # stats of dst dirs taken during processing, they are reused to restore
+    # dir mtimes, if content of the dir was not changed afterwards
+    dst_dir_stats = {}
+    # dst dirs with changed content (relative paths)
+    changed_dirs = set()
+
+    # scan and stat dst tree in thread pool as well, content of every dir
+    # is yielded before the dir itself, as needed for deleting; subtrees are
+    # streamed, so whole dst tree is not kept in memory
+    dst_entries = scantree_parallel(dst_root_abs, stat_entries=True,
+                                    dir_first=False)
 
     # process dst tree
-    for dst_entry in scantree(dst_root_abs, dir_first=False):
-        rel_path = dst_entry.path[len(dst_root_abs) + 1:]
+    dst_strip = len(dst_root_abs) + 1
+    for dst_entry in dst_entries:
+        rel_path = dst_entry.path[dst_strip:]
 
         src_entry = src_files_map.get(rel_path)
 
         # remove dst entries not existing in source
         if src_entry is None:
             _lg.debug("Rsync, deleting: %s", rel_path)
+            changed_dirs.add(os.path.dirname(rel_path))
             try:
                 rm_direntry(dst_entry)
                 yield rel_path, Actions.DELETE, ""
@@ -288,46 +936,16 @@ def rsync(src_dir,
         del src_files_map[rel_path]
 
         src_entry: os.DirEntry
-        # rewrite dst if it has different type from src
-        if src_entry.is_file(follow_symlinks=False):
-            if not dst_entry.is_file(follow_symlinks=False):
-                _lg.debug("Rsync, rewriting"
-                          " (src is a file, dst is not a file): %s",
-                          rel_path)
-                try:
-                    update_direntry(src_entry, dst_entry)
-                    yield rel_path, Actions.REWRITE, ""
-                except OSError as exc:
-                    yield rel_path, Actions.ERROR, str(exc)
-                continue
-
-        if src_entry.is_dir(follow_symlinks=False):
-            if not dst_entry.is_dir(follow_symlinks=False):
-                _lg.debug("Rsync, rewriting"
-                          " (src is a dir, dst is not a dir): %s",
-                          rel_path)
-                try:
-                    update_direntry(src_entry, dst_entry)
-                    yield rel_path, Actions.REWRITE, ""
-                except OSError as exc:
-                    yield rel_path, Actions.ERROR, str(exc)
-                continue
-
-        if src_entry.is_symlink():
-            if not dst_entry.is_symlink():
-                _lg.debug("Rsync, rewriting"
-                          " (src is a symlink, dst is not a symlink): %s",
-                          rel_path)
-                try:
-                    update_direntry(src_entry, dst_entry)
-                    yield rel_path, Actions.REWRITE, ""
-                except OSError as exc:
-                    yield rel_path, Actions.ERROR, str(exc)
-                continue
+        # stat is cached by DirEntry, file type is taken from it once
+        src_stat = src_entry.stat(follow_symlinks=False)
+        dst_stat = dst_entry.stat(follow_symlinks=False)
+        src_mode = src_stat.st_mode
+        dst_mode = dst_stat.st_mode
 
-        # rewrite dst if it is hard link to src (bad for backups)
-        if src_entry.inode() == dst_entry.inode():
-            _lg.debug("Rsync, rewriting (different inodes): %s", rel_path)
+        reason = _rewrite_reason(src_entry, dst_entry, src_stat, dst_stat)
+        if reason is not None:
+            _lg.debug("Rsync, rewriting (%s): %s", reason, rel_path)
+            changed_dirs.add(os.path.dirname(rel_path))
             try:
                 update_direntry(src_entry, dst_entry)
                 yield rel_path, Actions.REWRITE, ""
@@ -335,40 +953,15 @@ def rsync(src_dir,
                 yield rel_path, Actions.ERROR, str(exc)
             continue
 
-        src_stat = src_entry.stat(follow_symlinks=False)
-        dst_stat = dst_entry.stat(follow_symlinks=False)
-
-        # rewrite dst file/symlink which have different size or mtime than src
-        if src_entry.is_file(follow_symlinks=False):
-            same_size = src_stat.st_size == dst_stat.st_size
-            same_mtime = src_stat.st_mtime == dst_stat.st_mtime
-            if not (same_size and same_mtime):
-                reason = "size" if not same_size else "time"
-                _lg.debug("Rsync, rewriting (different %s): %s",
-                          reason, rel_path)
-                try:
-                    update_direntry(src_entry, dst_entry)
-                    yield rel_path, Actions.REWRITE, ""
-                except OSError as exc:
-                    yield rel_path, Actions.ERROR, str(exc)
-                continue
-
-        # rewrite dst symlink if it points somewhere else than src
-        if src_entry.is_symlink():
-            if os.readlink(src_entry.path) != os.readlink(dst_entry.path):
-                _lg.debug("Rsync, rewriting (different symlink target): %s",
-                          rel_path)
-                try:
-                    update_direntry(src_entry, dst_entry)
-                    yield rel_path, Actions.REWRITE, ""
-                except OSError as exc:
-                    yield rel_path, Actions.ERROR, str(exc)
-                continue
+        # content of dir is processed before it, so its mtime is final
+        # unless new entries are created in it
+        if stat.S_ISDIR(src_mode):
+            dst_dir_stats[rel_path] = dst_stat
 
         # update permissions and ownership
-        if src_stat.st_mode != dst_stat.st_mode:
+        if src_mode != dst_mode:
             _lg.debug("Rsync, updating permissions: %s", rel_path)
-            os.chmod(dst_entry.path, dst_stat.st_mode)
+            os.chmod(dst_entry.path, src_mode)
             yield rel_path, Actions.UPDATE_PERM, ""
 
         if (src_stat.st_uid != dst_stat.st_uid
@@ -377,37 +970,47 @@ def rsync(src_dir,
             os.chown(dst_entry.path, src_stat.st_uid, src_stat.st_gid)
             yield rel_path, Actions.UPDATE_OWNER, ""
 
-    # process remained source entries (new files/dirs/symlinks)
+    # process remained source entries (new files/dirs/symlinks),
+    # directories are created first in scan order, so parents exist before
+    # their content, other entries are copied afterwards
+    new_files = []
     for rel_path, src_entry in src_files_map.items():
         dst_path = os.path.join(dst_root_abs, rel_path)
+        changed_dirs.add(os.path.dirname(rel_path))
+        if not src_entry.is_dir(follow_symlinks=False):
+            new_files.append((rel_path, src_entry, dst_path))
+            continue
         _lg.debug("Rsync, creating: %s", rel_path)
         try:
             copy_direntry(src_entry, dst_path)
             yield rel_path, Actions.CREATE, ""
         except OSError as exc:
             yield rel_path, Actions.ERROR, str(exc)
+    yield from _copy_new_files(new_files)
 
     # restore dir mtimes in dst, updated by updating files
-    for src_entry in scantree(src_root_abs, dir_first=True):
-        if not src_entry.is_dir():
-            continue
-        rel_path = src_entry.path[len(src_root_abs) + 1:]
+    for rel_path, src_entry in src_dirs:
         dst_path = os.path.join(dst_root_abs, rel_path)
         src_stat = src_entry.stat(follow_symlinks=False)
-        dst_stat = os.lstat(dst_path)
-        if src_stat.st_mtime != dst_stat.st_mtime:
-            _lg.debug("Rsync, restoring directory mtime: %s", dst_path)
-            os.utime(dst_path,
-                     (src_stat.st_atime, src_stat.st_mtime),
-                     follow_symlinks=False)
+        # mtime of dir with changed content is reset without checking it
+        if rel_path not in changed_dirs:
+            dst_stat = dst_dir_stats.get(rel_path)
+            if dst_stat is None:
+                dst_stat = os.lstat(dst_path)
+            if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+                continue
+        _lg.debug("Rsync, restoring directory mtime: %s", dst_path)
+        os.utime(dst_path,
+                 ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns),
+                 follow_symlinks=False)
 
     # restore dst_root dir mtime
     src_root_stat = os.lstat(src_root_abs)
     dst_root_stat = os.lstat(dst_root_abs)
-    if src_root_stat.st_mtime != dst_root_stat.st_mtime:
+    if src_root_stat.st_mtime_ns != dst_root_stat.st_mtime_ns:
         _lg.debug("Rsync, restoring root directory mtime: %s", dst_root_abs)
         os.utime(dst_root_abs,
-                 (src_root_stat.st_atime, src_root_stat.st_mtime),
+                 ns=(src_root_stat.st_atime_ns, src_root_stat.st_mtime_ns),
                  follow_symlinks=False)
 
 
@@ -422,55 +1025,165 @@ def _recursive_hardlink_ext(src: str, dst: str) -> bool:
         cp = "gcp"
     else:
         cp = "cp"
-    src_content = glob.glob(f"{src}/*")
-    cmd = [cp, "--archive", "--verbose", "--link", *src_content, dst]
+    # "src/." copies whole content of src (including hidden entries) into
+    # existing dst without listing it in argument list
+    cmd = [cp, "--archive", "--link"]
+    # output is only logged, so don't make cp print every entry otherwise
+    log_debug = _lg.isEnabledFor(logging.DEBUG)
+    if log_debug:
+        cmd.append("--verbose")
+    cmd.extend(["--", os.path.join(src, "."), dst])
     _lg.info("Executing external command: %s", " ".join(cmd))
-    process = subprocess.Popen(cmd,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT)
-    with process.stdout:
-        for line in iter(process.stdout.readline, b""):
-            _lg.debug("%s: %s", cp, line.decode("utf-8").strip())
+    # without debug only errors are read, regular output is discarded
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE if log_debug else subprocess.DEVNULL,
+        stderr=subprocess.STDOUT if log_debug else subprocess.PIPE,
+    )
+    output = process.stdout if log_debug else process.stderr
+    with output:
+        for line in iter(output.readline, b""):
+            if log_debug:
+                _lg.debug("%s: %s", cp, line.decode("utf-8").strip())
+            else:
+                _lg.error("%s: %s", cp, line.decode("utf-8").strip())
     exitcode = process.wait()
     return not bool(exitcode)
 
 
-def _recursive_hardlink(src: str, dst: str) -> bool:
+def _hardlink_dir_content(
+        src_dir: bytes, dst_dir: bytes,
+) -> List[Tuple[bytes, bytes, os.stat_result]]:
+    """
+    Hardlink files and symlinks of src_dir into dst_dir, create (empty)
+    subdirectories of src_dir in dst_dir.
+    Paths are bytes, so names from scandir are passed to syscalls as is,
+    without decoding and encoding them back.
+    :return: list of (src path, dst path, src stat) of created subdirectories.
+    """
+    log_debug = _lg.isEnabledFor(logging.DEBUG)
+    # local name for function called for every entry
+    link = os.link
+    # dst paths of entries are built by concatenation with ready prefix,
+    # join adds separator only if dst_dir doesn't end with it already
+    dst_prefix = os.path.join(dst_dir, b"")
+    subdirs = []
+    # entries are linked and subdirectories are created relative to opened
+    # directories where possible, so kernel doesn't resolve whole paths
+    # for every entry
+    src_dir_fd = dst_dir_fd = None
+    try:
+        if _LINK_DIR_FD:
+            src_dir_fd = os.open(src_dir, _SRC_DIR_FLAGS)
+            dst_dir_fd = os.open(dst_dir, _DIR_FLAGS)
+        with os.scandir(src_dir) as it:
+            entries = list(it)
+        # process entries in inode order, so source inodes are read from
+        # disk sequentially; inode numbers are known from scandir on POSIX
+        entries.sort(key=os.DirEntry.inode)
+        ent: os.DirEntry
+        for ent in entries:
+            # regular files are the most common entries, check them
+            # first; type is known from scandir without stat
+            if ent.is_file(follow_symlinks=False) or ent.is_symlink():
+                if log_debug:
+                    _lg.debug("Hardlink, creating link for file: %s -> %s",
+                              os.fsdecode(ent.path),
+                              os.fsdecode(dst_prefix + ent.name))
+                try:
+                    if src_dir_fd is None:
+                        link(ent.path, dst_prefix + ent.name,
+                             follow_symlinks=False)
+                    else:
+                        link(ent.name, ent.name,
+                             src_dir_fd=src_dir_fd,
+                             dst_dir_fd=dst_dir_fd,
+                             follow_symlinks=False)
+                except OSError as exc:
+                    if exc.errno not in _LINK_FALLBACK_ERRNOS:
+                        raise
+                    # copy entry instead, data is copied in kernel by
+                    # copy_file_range, it makes reflink on CoW filesystems
+                    _lg.debug("Hardlink, can't link (%s), copying: %s",
+                              exc, os.fsdecode(ent.path))
+                    copy_direntry(ent, dst_prefix + ent.name)
+                continue
+            if ent.is_dir(follow_symlinks=False):
+                ent_dst_path = dst_prefix + ent.name
+                if log_debug:
+                    _lg.debug("Hardlink, copying directory: %s -> %s",
+                              os.fsdecode(ent.path),
+                              os.fsdecode(ent_dst_path))
+                os.mkdir(ent_dst_path if dst_dir_fd is None
+                         else ent.name, dir_fd=dst_dir_fd)
+                subdirs.append((ent.path, ent_dst_path,
+                                ent.stat(follow_symlinks=False)))
+                continue
+            # something that is not a file, symlink or directory
+            raise NotImplementedError(os.fsdecode(ent.path))
+    finally:
+        for dir_fd in (src_dir_fd, dst_dir_fd):
+            if dir_fd is not None:
+                os.close(dir_fd)
+    return subdirs
+
+
+def _recursive_hardlink(src: str, dst: str,
+                        workers: int = HARDLINK_WORKERS) -> bool:
     """
     Do hardlink directory recursively using python only.
     Both src and dst directories should exist.
+    Directories are processed in parallel, each by single thread.
     :param src: absolute path to source directory.
     :param dst: absolute path to target directory.
     :return: True if success, False otherwise.
     """
-    with os.scandir(src) as it:
-        ent: os.DirEntry
-        for ent in it:
-            ent_dst_path = os.path.join(dst, ent.name)
-            if ent.is_dir(follow_symlinks=False):
-                _lg.debug("Hardlink, copying directory: %s -> %s",
-                          ent.path, ent_dst_path)
-                os.mkdir(ent_dst_path)
-
-                # process directory children
-                _recursive_hardlink(ent.path, ent_dst_path)
+    # created subdirectories, grouped by their parent directory
+    created_dirs = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(_hardlink_dir_content,
+                                   os.fsencode(src), os.fsencode(dst))}
+        while pending:
+            done, pending = futures.wait(pending,
+                                         return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                subdirs = future.result()
+                if subdirs:
+                    created_dirs.append(subdirs)
+                for src_dir, dst_dir, _ in subdirs:
+                    pending.add(executor.submit(_hardlink_dir_content,
+                                                src_dir, dst_dir))
+
+    # directory metainfo is saved only after all content is linked,
+    # so directories are not changed (or made read-only) afterwards;
+    # subdirectories are found after their parent, so in reversed order
+    # every directory is processed before its parent
+    for subdirs in reversed(created_dirs):
+        _copy_dirs_stat(subdirs)
 
-                # save directory's metainfo
-                ent_stat = ent.stat(follow_symlinks=False)
-                os.chown(ent_dst_path, ent_stat.st_uid, ent_stat.st_gid)
-                os.chmod(ent_dst_path, ent_stat.st_mode)
-                os.utime(ent_dst_path, (ent_stat.st_atime, ent_stat.st_mtime))
+    return True
 
-                continue
-            if ent.is_file(follow_symlinks=False) or ent.is_symlink():
-                _lg.debug("Hardlink, creating link for file: %s -> %s",
-                          ent.path, ent_dst_path)
-                os.link(ent.path, ent_dst_path, follow_symlinks=False)
-                continue
-            # something that is not a file, symlink or directory
-            raise NotImplementedError(ent.path)
 
-    return True
+def _copy_dirs_stat(dirs: List[Tuple[bytes, bytes, os.stat_result]]):
+    """
+    Set owner, permissions and times of created directories from their
+    source stats. All directories should be in the same parent directory,
+    they are changed relative to it, so their paths are not resolved again.
+    :param dirs: list of (src path, dst path, src stat) of directories.
+    """
+    dir_fd = None
+    try:
+        if _META_DIR_FD:
+            dir_fd = os.open(os.path.dirname(dirs[0][1]), _DIR_FLAGS)
+        for _, dst_dir, dir_stat in dirs:
+            path = dst_dir if dir_fd is None else os.path.basename(dst_dir)
+            os.chown(path, dir_stat.st_uid, dir_stat.st_gid, dir_fd=dir_fd)
+            os.chmod(path, dir_stat.st_mode, dir_fd=dir_fd)
+            os.utime(path, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns),
+                     dir_fd=dir_fd)
+    finally:
+        if dir_fd is not None:
+            os.close(dir_fd)
 
 
 def hardlink_dir(src_dir, dst_dir, use_external: bool = False) -> bool:
@@ -487,10 +1200,11 @@ def hardlink_dir(src_dir, dst_dir, use_external: bool = False) -> bool:
 
     if not os.path.isdir(src_abs):
         raise RuntimeError(f"Error reading source directory: {src_dir}")
-    if os.path.exists(dst_abs):
-        raise RuntimeError(f"Destination already exists: {dst_dir}")
     _lg.debug("Hardlink, creating directory: %s", dst_abs)
-    os.mkdir(dst_abs)
+    try:
+        os.mkdir(dst_abs)
+    except FileExistsError:
+        raise RuntimeError(f"Destination already exists: {dst_dir}")
 
     hardlink_func = (_recursive_hardlink_ext if use_external
                      else _recursive_hardlink)
@@ -499,35 +1213,45 @@ def hardlink_dir(src_dir, dst_dir, use_external: bool = False) -> bool:
 
 def nest_hardlink(src_dir: str, src_relpath: str, dst_dir: str):
     """
-    Hardlink entity from (src_dir + src_relpath) to dst_dir preserving dir
-    structure of src_relpath.
+    Copy entity from (src_dir + src_relpath) to dst_dir preserving dir
+    structure of src_relpath. Could be called for entries of the same
+    directory concurrently.
     """
     _lg.debug("Nested hardlinking: %s%s%s -> %s",
               src_dir, os.path.sep, src_relpath, dst_dir)
+    # external rsync reports directories with trailing separator
+    src_relpath = src_relpath.rstrip(os.path.sep)
     src_dir_abs = os.path.abspath(src_dir)
     src_full_path = os.path.join(src_dir_abs, src_relpath)
     dst_dir_abs = os.path.abspath(dst_dir)
     dst_full_path = os.path.join(dst_dir_abs, src_relpath)
 
     # check source entity and destination directory
-    if not os.path.lexists(src_full_path):
+    try:
+        src_stat = os.lstat(src_full_path)
+    except FileNotFoundError:
         raise RuntimeError("Error reading source entity: %s" % src_full_path)
-    if os.path.lexists(dst_dir_abs):
+    # dst_dir could be created concurrently by nest_hardlink for other entry
+    try:
+        os.mkdir(dst_dir_abs)
+    except FileExistsError:
         if not os.path.isdir(dst_dir_abs):
             raise RuntimeError("Destination path is not a directory: %s"
                                % dst_dir_abs)
-    else:
-        os.mkdir(dst_dir_abs)
 
     # if destination entity exists, check it points to source entity
     dst_entry = PseudoDirEntry(dst_full_path)
     if os.path.lexists(dst_entry.path):
-        src_stat = os.lstat(src_full_path)
-        if os.path.samestat(src_stat, dst_entry.stat()):
+        # directory could be already created for its nested entry
+        if stat.S_ISDIR(src_stat.st_mode) and dst_entry.is_dir(
+                follow_symlinks=False):
+            return
+        if os.path.samestat(src_stat, dst_entry.stat(follow_symlinks=False)):
             return
         # remove otherwise
         rm_direntry(dst_entry)
 
+    # create parent directories and entity itself
     src_cur_path = src_dir_abs
     dst_cur_path = dst_dir_abs
     for rel_part in src_relpath.split(sep=os.path.sep):
@@ -535,4 +1259,8 @@ def nest_hardlink(src_dir: str, src_relpath: str, dst_dir: str):
         dst_cur_path = os.path.join(dst_cur_path, rel_part)
         if os.path.exists(dst_cur_path):
             continue
-        copy_direntry(PseudoDirEntry(src_cur_path), dst_cur_path)
+        try:
+            copy_direntry(PseudoDirEntry(src_cur_path), dst_cur_path)
+        except FileExistsError:
+            # created concurrently for other entry
+            pass
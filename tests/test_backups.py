@@ -1,7 +1,9 @@
 import os
 import random
+import shutil
 import string
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase, mock
 from datetime import datetime
 
@@ -48,7 +50,7 @@ class TestBackupCleanup(TestCase):
             "keep_yearly": None,
         }
         cleanup_kwargs.update(**kwargs)
-        bk.cleanup_old_backups(**cleanup_kwargs)
+        return bk.cleanup_old_backups(**cleanup_kwargs)
 
     def test_no_backups(self):
         """ Test behaviour with no available backups """
@@ -169,6 +171,17 @@ class TestBackupCleanup(TestCase):
         self._run_cleanup(keep_weekly=5)
         self._check_backups(expected_backups)
 
+    @mock.patch(f"{bk.__name__}.datetime", wraps=datetime)
+    def test_keep_weekly_same_week_number(self, mock_datetime):
+        """ Test weekly backups with same week number in different years """
+        mock_datetime.now.return_value = datetime(2021, 11, 11)
+        backups = [
+            self._add_backup("20211104_0100"),  # keep, week 44 of 2021
+            self._add_backup("20201029_0100"),  # keep, week 44 of 2020
+        ]
+        self._run_cleanup(keep_weekly=60)
+        self._check_backups(backups)
+
     @mock.patch(f"{bk.__name__}.datetime", wraps=datetime)
     def test_keep_monthly_threshold_only(self, mock_datetime):
         """ Test threshold for keeping monthly backups """
@@ -224,6 +237,173 @@ class TestBackupCleanup(TestCase):
         self._run_cleanup(keep_all=2, dry_run=True)
         self._check_backups(backups)
 
+    @mock.patch(f"{bk.__name__}.datetime", wraps=datetime)
+    def test_returns_left_backups(self, mock_datetime):
+        """ Test cleanup returns snapshot of backups left after it """
+        mock_datetime.now.return_value = datetime(2021, 10, 20)
+        backups = [
+            self._add_backup("20211019_0300"),  # keep
+            self._add_backup("20211017_0100"),  # keep
+            self._add_backup("20211016_2300"),  # remove, older than 3 days
+        ]
+        snapshot = bk.snapshot_backups(self.backup_dir.name)
+        self.assertEqual([b.name for b in reversed(backups)],
+                         [b.name for b in snapshot])
+        left = self._run_cleanup(keep_all=3, backups=snapshot)
+        self.assertEqual([backups[1].name, backups[0].name],
+                         [b.name for b in left])
+        self._check_backups(backups[:2])
+
+    def test_not_backups_ignored(self):
+        """ Test entries with invalid backup names are not backups """
+        backup = self._add_backup("20211019_0300")
+        self._add_backup("20211341_0300")  # invalid date
+        self._add_backup("20211019_03000000")  # too long name
+        self._add_backup("20211019_03000")  # neither HHMM nor HHMMSS
+        self.assertEqual([backup.name],
+                         [b.name for b in
+                          bk.snapshot_backups(self.backup_dir.name)])
+
+    def test_backup_name_without_seconds(self):
+        """ Test time in old backup names is HHMM, not HMMSS """
+        backup = self._add_backup("20211019_1234")
+        self.assertEqual(datetime(2021, 10, 19, 12, 34),
+                         bk._date_from_backup(backup))
+
+    def test_latest_backup(self):
+        """ Test newer dirs without backup marker are not latest backup """
+        self._add_backup("20211018_0300")
+        latest = self._add_backup("20211019_0300")
+        os.mkdir(os.path.join(self.backup_dir.name, "20211020_0300"))
+        os.mkdir(os.path.join(self.backup_dir.name, "20211021_0300"))
+        self.assertEqual(latest.name,
+                         bk._get_latest_backup(self.backup_dir.name).name)
+
+
+class TestBackupLock(TestCase):
+    def setUp(self) -> None:
+        self.backup_dir = tempfile.TemporaryDirectory(prefix="backup_")
+        self.lock_path = os.path.join(self.backup_dir.name, bk.LOCK_FILE)
+
+    def tearDown(self) -> None:
+        self.backup_dir.cleanup()
+
+    def test_set_lock(self):
+        """ Test lock file is created with current PID """
+        self.assertTrue(bk.set_backups_lock(self.backup_dir.name))
+        with open(self.lock_path) as f:
+            self.assertEqual(str(os.getpid()), f.read())
+
+    def test_lock_is_held(self):
+        """ Test lock can't be set while process from lock file is alive """
+        self.assertTrue(bk.set_backups_lock(self.backup_dir.name))
+        self.assertFalse(bk.set_backups_lock(self.backup_dir.name))
+
+    def test_release_lock(self):
+        """ Test lock could be set again after release """
+        bk.set_backups_lock(self.backup_dir.name)
+        bk.release_backups_lock(self.backup_dir.name)
+        self.assertFalse(os.path.exists(self.lock_path))
+        self.assertTrue(bk.set_backups_lock(self.backup_dir.name))
+
+    def _check_lock_owned(self):
+        with open(self.lock_path) as f:
+            self.assertEqual(str(os.getpid()), f.read())
+
+    def test_stale_lock(self):
+        """ Test stale lock is replaced with own lock """
+        with open(self.lock_path, "w") as f:
+            f.write("12345")
+        with mock.patch.object(bk, "_pid_exists", return_value=False):
+            self.assertTrue(bk.set_backups_lock(self.backup_dir.name))
+        self._check_lock_owned()
+
+    def test_forced_lock(self):
+        """ Test lock of running process is replaced with force flag """
+        with open(self.lock_path, "w") as f:
+            f.write("12345")
+        with mock.patch.object(bk, "_pid_exists", return_value=True), \
+                mock.patch.object(bk.os, "kill") as kill_mock:
+            self.assertTrue(bk.set_backups_lock(self.backup_dir.name,
+                                                force=True))
+        kill_mock.assert_called_once_with(12345, bk.signal.SIGKILL)
+        self._check_lock_owned()
+
+    def test_empty_lock(self):
+        """ Test empty lock file is waited for and then considered stale """
+        open(self.lock_path, "w").close()
+        with mock.patch.object(bk, "LOCK_READ_DELAY", 0):
+            self.assertTrue(bk.set_backups_lock(self.backup_dir.name))
+        self._check_lock_owned()
+
+    def test_lock_being_written(self):
+        """ Test PID written to lock file after its creation is read """
+        open(self.lock_path, "w").close()
+
+        def write_pid(delay):
+            with open(self.lock_path, "w") as f:
+                f.write(str(os.getpid()))
+
+        with mock.patch.object(bk.time, "sleep", side_effect=write_pid):
+            self.assertFalse(bk.set_backups_lock(self.backup_dir.name))
+
+
+class TestProcessBackedEntries(TestCase):
+    def setUp(self) -> None:
+        self.backup_dir = tempfile.TemporaryDirectory(prefix="backup_")
+        self.delta_dir = os.path.join(self.backup_dir.name, bk.DELTA_DIR)
+
+    def tearDown(self) -> None:
+        self.backup_dir.cleanup()
+
+    def test_same_entry_in_batch(self):
+        """ Test entry reported several times in batch is processed once """
+        src_dir = os.path.join(self.backup_dir.name, "src")
+        os.mkdir(src_dir)
+        relpaths = []
+        for i in range(64):
+            relpath = os.path.join("src", f"file_{i}")
+            relpaths.append(relpath)
+            with open(os.path.join(self.backup_dir.name, relpath), "wb") as f:
+                f.write(relpath.encode())
+        entries = []
+        for relpath in relpaths:
+            entries.append((relpath, fs.Actions.UPDATE_PERM, ""))
+            entries.append((relpath, fs.Actions.UPDATE_OWNER, ""))
+
+        # concurrent processing of the same entry fails only sometimes
+        for _ in range(20):
+            with ThreadPoolExecutor(max_workers=bk.PROCESS_WORKERS) as ex:
+                bk._process_backed_entries(ex, self.backup_dir.name,
+                                           entries, self.delta_dir)
+            for relpath in relpaths:
+                with open(os.path.join(self.delta_dir, relpath), "rb") as f:
+                    self.assertEqual(relpath.encode(), f.read())
+            shutil.rmtree(self.delta_dir)
+
+
+class TestInitiateBackup(TestCase):
+    def setUp(self) -> None:
+        self.backup_dir = tempfile.TemporaryDirectory(prefix="backup_")
+        self.src_dir = tempfile.TemporaryDirectory(prefix="source_")
+
+    def tearDown(self) -> None:
+        self.backup_dir.cleanup()
+        self.src_dir.cleanup()
+
+    def test_sources_with_same_name(self):
+        """ Test sources, synced into the same backup dir, are rejected """
+        sources = []
+        for parent in ("a", "b"):
+            src = os.path.join(self.src_dir.name, parent, "data")
+            os.makedirs(src)
+            with open(os.path.join(src, parent), "w") as f:
+                f.write(parent)
+            sources.append(src)
+
+        self.assertEqual(["data"], bk.duplicate_source_names(sources))
+        self.assertFalse(bk.initiate_backup(sources, self.backup_dir.name))
+        self.assertEqual([], os.listdir(self.backup_dir.name))
+
 
 # TODO add tests for iterating over backups (marker, dirname)
-# TODO add tests for backups dir lockfile
@@ -1,13 +1,21 @@
+import errno
+import io
 import os
 import os.path
 import shutil
 import socket
 import string
+import sys
 import tempfile
+import time
 import unittest
+from unittest import mock
 
 from curateipsum import fs
 
+# content of files created by tests
+_FILE_CONTENT = string.printable.encode("ascii")
+
 
 class CommonFSTestCase(unittest.TestCase):
     def setUp(self):
@@ -27,8 +35,10 @@ class CommonFSTestCase(unittest.TestCase):
         Returns absolute path to created file.
         """
         fd, path = tempfile.mkstemp(prefix=prefix, dir=parent_dir)
-        with open(fd, "w") as f:
-            f.write(string.printable)
+        try:
+            os.write(fd, _FILE_CONTENT)
+        finally:
+            os.close(fd)
         return path
 
     @staticmethod
@@ -53,9 +63,12 @@ class CommonFSTestCase(unittest.TestCase):
 
 class TestHardlinkDir(CommonFSTestCase):
     def setUp(self):
-        self.tmp_dir = tempfile.TemporaryDirectory(prefix="source_")
-        self.src_dir = self.tmp_dir.name
+        # src and dst are created in single temporary directory,
+        # so both are removed by its cleanup
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix="hardlink_")
+        self.src_dir = os.path.join(self.tmp_dir.name, "source")
         self.dst_dir = self.src_dir + ".copy"
+        os.mkdir(self.src_dir)
 
     @staticmethod
     def check_directory_stats(d1_path: str, d2_path: str):
@@ -83,11 +96,43 @@ class TestHardlinkDir(CommonFSTestCase):
         assert os.path.samestat(src_stat, dst_stat)
         assert src_stat.st_nlink == 2
 
+    @unittest.skipIf(shutil.which("gcp" if sys.platform == "darwin"
+                                  else "cp") is None, "no external cp")
+    def test_external_cp(self):
+        """ Test external cp links all files, including hidden ones. """
+        cf_paths = [self.create_file(self.src_dir, prefix=".hidden"),
+                    self.create_file(self.src_dir)]
+
+        assert fs.hardlink_dir(self.src_dir, self.dst_dir, use_external=True)
+
+        for cf_path in cf_paths:
+            dst_path = os.path.join(self.dst_dir, self.relpath(cf_path))
+            assert os.path.samestat(os.lstat(cf_path), os.lstat(dst_path))
+
+    def check_link_fallback(self, link_errno: int):
+        """ Check file is copied if it can't be hardlinked. """
+        cf_path = self.create_file(self.src_dir)
+        dst_path = os.path.join(self.dst_dir, self.relpath(cf_path))
+
+        link_error = OSError(link_errno, os.strerror(link_errno))
+        with mock.patch.object(os, "link", side_effect=link_error):
+            fs.hardlink_dir(self.src_dir, self.dst_dir)
+
+        assert not os.path.samestat(os.lstat(cf_path), os.lstat(dst_path))
+        with open(cf_path, "rb") as f1, open(dst_path, "rb") as f2:
+            assert f1.read() == f2.read()
+
+    def test_too_many_links(self):
+        self.check_link_fallback(errno.EMLINK)
+
+    def test_cross_device_link(self):
+        self.check_link_fallback(errno.EXDEV)
+
     def test_relative_symlink_to_common_file(self):
         cf_relpath = self.relpath(self.create_file(self.src_dir))
         sl2cf_relpath = "symlink_to_common_file"
-        os.chdir(self.src_dir)
-        os.symlink(cf_relpath, sl2cf_relpath)
+        # relative target is resolved from symlink directory, not from cwd
+        os.symlink(cf_relpath, os.path.join(self.src_dir, sl2cf_relpath))
 
         fs.hardlink_dir(self.src_dir, self.dst_dir)
 
@@ -151,9 +196,302 @@ class TestHardlinkDir(CommonFSTestCase):
         assert os.path.samestat(src_fstat, dst_fstat)
         assert src_fstat.st_nlink == 2
 
+    def test_deep_nested_dir(self):
+        src_ndir_path = self.create_dir(self.src_dir)
+        src_nndir_path = self.create_dir(src_ndir_path)
+        self.create_file(src_nndir_path)
+        self.create_file(src_ndir_path)
+
+        fs.hardlink_dir(self.src_dir, self.dst_dir)
+        for src_path in (src_ndir_path, src_nndir_path):
+            dst_path = os.path.join(self.dst_dir, self.relpath(src_path))
+            self.check_directory_stats(src_path, dst_path)
+
     def tearDown(self):
         self.tmp_dir.cleanup()
-        shutil.rmtree(self.dst_dir, ignore_errors=True)
+
+
+class TestScantree(CommonFSTestCase):
+    def create_tree(self, subdirs: int):
+        """ Create two levels of nested directories with files in src_dir. """
+        for _ in range(subdirs):
+            dpath = self.create_dir(self.src_dir)
+            self.create_file(dpath)
+            self.create_file(self.create_dir(dpath))
+        self.create_file(self.src_dir)
+
+    def check_scantree_parallel(self, dir_first=True,
+                                workers=fs.SCAN_WORKERS):
+        expected = sorted(e.path for e in fs.scantree(self.src_dir))
+        entries = [e.path for e in fs.scantree_parallel(self.src_dir,
+                                                        workers=workers,
+                                                        dir_first=dir_first)]
+        assert sorted(entries) == expected
+
+        # parent directory is yielded before or after its content
+        for idx, path in enumerate(entries):
+            parent = os.path.dirname(path)
+            if parent != self.src_dir:
+                if dir_first:
+                    assert entries.index(parent) < idx
+                else:
+                    assert entries.index(parent) > idx
+
+    def test_parallel_scan(self):
+        self.create_tree(subdirs=fs.PARALLEL_SCAN_MIN_DIRS + 2)
+        self.check_scantree_parallel()
+
+    def test_serial_scan(self):
+        self.create_tree(subdirs=fs.PARALLEL_SCAN_MIN_DIRS)
+        self.check_scantree_parallel()
+
+    def test_parallel_scan_content_first(self):
+        self.create_tree(subdirs=fs.PARALLEL_SCAN_MIN_DIRS + 2)
+        # less workers than subdirs, so subtrees are scanned in turns
+        self.check_scantree_parallel(dir_first=False, workers=2)
+
+    def test_serial_scan_content_first(self):
+        self.create_tree(subdirs=fs.PARALLEL_SCAN_MIN_DIRS)
+        self.check_scantree_parallel(dir_first=False)
+
+    def test_parallel_scan_content_first_stopped(self):
+        """ Test scanning stops if caller stops getting entries. """
+        self.create_tree(subdirs=fs.PARALLEL_SCAN_MIN_DIRS + 2)
+        with mock.patch.object(fs, "SCAN_READ_AHEAD", 1):
+            entries = fs.scantree_parallel(self.src_dir, dir_first=False)
+            next(entries)
+            entries.close()
+
+
+class TestNestHardlink(CommonFSTestCase):
+    @staticmethod
+    def check_copied(src_path: str, dst_path: str):
+        """ Check that file content was copied. """
+        with open(src_path, "rb") as f1, open(dst_path, "rb") as f2:
+            assert f1.read() == f2.read()
+
+    def test_nested_file(self):
+        src_dpath = self.create_dir(self.src_dir)
+        src_fpath = self.create_file(src_dpath)
+        relpath = self.relpath(src_fpath)
+        dst_fpath = os.path.join(self.dst_dir, relpath)
+
+        fs.nest_hardlink(self.src_dir, relpath, self.dst_dir)
+        assert os.path.isdir(os.path.dirname(dst_fpath))
+        self.check_copied(src_fpath, dst_fpath)
+
+        # entry is processed again without errors
+        fs.nest_hardlink(self.src_dir, relpath, self.dst_dir)
+        self.check_copied(src_fpath, dst_fpath)
+
+    def test_dir_after_nested_file(self):
+        """ Test directory content is kept if directory is processed late. """
+        src_dpath = self.create_dir(self.src_dir)
+        src_fpath = self.create_file(src_dpath)
+        dst_fpath = os.path.join(self.dst_dir, self.relpath(src_fpath))
+
+        fs.nest_hardlink(self.src_dir, self.relpath(src_fpath), self.dst_dir)
+        fs.nest_hardlink(self.src_dir, self.relpath(src_dpath) + os.path.sep,
+                         self.dst_dir)
+        self.check_copied(src_fpath, dst_fpath)
+
+
+class TestRmDirentry(CommonFSTestCase):
+    def test_empty_dir(self):
+        dpath = self.create_dir(self.src_dir)
+        fs.rm_direntry(fs.PseudoDirEntry(dpath))
+        assert not os.path.lexists(dpath)
+
+    def test_dir_with_content(self):
+        dpath = self.create_dir(self.src_dir)
+        self.create_file(dpath)
+        self.create_file(self.create_dir(dpath))
+        os.symlink("nowhere", os.path.join(dpath, "broken"))
+
+        fs.rm_direntry(fs.PseudoDirEntry(dpath))
+        assert not os.path.lexists(dpath)
+
+
+class TestCopyFile(CommonFSTestCase):
+    def check_copied(self, src_path: str, dst_path: str):
+        """ Check that file content and mode were copied. """
+        with open(src_path, "rb") as f1, open(dst_path, "rb") as f2:
+            assert f1.read() == f2.read()
+        assert os.lstat(src_path).st_mode == os.lstat(dst_path).st_mode
+
+    def test_copy_file(self):
+        src_path = self.create_file(self.src_dir)
+        dst_path = os.path.join(self.dst_dir, self.relpath(src_path))
+
+        fs.copy_file(src_path, dst_path)
+        self.check_copied(src_path, dst_path)
+
+    def test_copy_empty_file(self):
+        src_path = os.path.join(self.src_dir, "empty_file")
+        open(src_path, "w").close()
+        dst_path = os.path.join(self.dst_dir, "empty_file")
+
+        fs.copy_file(src_path, dst_path)
+        self.check_copied(src_path, dst_path)
+
+    def test_copy_file_stat(self):
+        src_path = self.create_file(self.src_dir)
+        dst_path = os.path.join(self.dst_dir, self.relpath(src_path))
+        os.chmod(src_path, 0o640)
+        os.utime(src_path, (1000000000, 1000000000))
+
+        fs.copy_file(src_path, dst_path, copy_stat=True)
+        self.check_copied(src_path, dst_path)
+        assert os.lstat(dst_path).st_mtime == 1000000000
+
+    def test_copy_file_fallback(self):
+        """ Test copy falls back to buffered copy if kernel copy fails. """
+        src_path = self.create_file(self.src_dir)
+        dst_path = os.path.join(self.dst_dir, self.relpath(src_path))
+
+        def not_supported(fin, fout, size):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+        with mock.patch.object(fs, "_COPY_FUNCS",
+                               [not_supported, fs._copy_buffered]):
+            fs.copy_file(src_path, dst_path)
+        self.check_copied(src_path, dst_path)
+
+    def test_copy_file_fallback_any_error(self):
+        """ Test copy falls back on any error if nothing is written yet. """
+        src_path = self.create_file(self.src_dir)
+        dst_path = os.path.join(self.dst_dir, self.relpath(src_path))
+
+        def not_permitted(fin, fout, size):
+            os.read(fin, 1)
+            raise OSError(errno.EPERM, os.strerror(errno.EPERM))
+
+        with mock.patch.object(fs, "_COPY_FUNCS",
+                               [not_permitted, fs._copy_buffered]):
+            fs.copy_file(src_path, dst_path)
+        self.check_copied(src_path, dst_path)
+
+    def test_copy_file_fallback_nothing_copied(self):
+        """ Test copy falls back if copy function copied nothing. """
+        src_path = self.create_file(self.src_dir)
+        dst_path = os.path.join(self.dst_dir, self.relpath(src_path))
+
+        with mock.patch.object(fs, "_COPY_FUNCS",
+                               [lambda fin, fout, size: 0, fs._copy_buffered]):
+            fs.copy_file(src_path, dst_path)
+        self.check_copied(src_path, dst_path)
+
+    def test_copy_file_no_fallback_after_write(self):
+        """ Test copy doesn't fall back if some data is written already. """
+        src_path = self.create_file(self.src_dir)
+        dst_path = os.path.join(self.dst_dir, self.relpath(src_path))
+
+        def write_failed(fin, fout, size):
+            os.write(fout, os.read(fin, 1))
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+        with mock.patch.object(fs, "_COPY_FUNCS",
+                               [write_failed, fs._copy_buffered]):
+            with self.assertRaises(OSError):
+                fs.copy_file(src_path, dst_path)
+
+    def test_copy_func_not_implemented(self):
+        """ Test copy function not implemented by kernel is not used again. """
+        src_path = self.create_file(self.src_dir)
+        dst_path = os.path.join(self.dst_dir, self.relpath(src_path))
+
+        def not_implemented(fin, fout, size):
+            raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+
+        with mock.patch.object(fs, "_COPY_FUNCS",
+                               [not_implemented, fs._copy_buffered]):
+            fs.copy_file(src_path, dst_path)
+            assert fs._COPY_FUNCS == [fs._copy_buffered]
+        self.check_copied(src_path, dst_path)
+
+    def test_copy_buffered_small_buffer(self):
+        """ Test buffered copy of file larger than copy buffer. """
+        src_path = self.create_file(self.src_dir)
+        dst_path = os.path.join(self.dst_dir, self.relpath(src_path))
+
+        with mock.patch.object(fs, "_COPY_FUNCS", [fs._copy_buffered]), \
+                mock.patch.object(fs, "BUFFER_SIZE", 3):
+            fs.copy_file(src_path, dst_path)
+        self.check_copied(src_path, dst_path)
+
+    def test_copy_buffered_fadvise(self):
+        """ Test buffered copy with access pattern hints for kernel. """
+        src_path = self.create_file(self.src_dir)
+        dst_path = os.path.join(self.dst_dir, self.relpath(src_path))
+
+        with mock.patch.object(fs, "_COPY_FUNCS", [fs._copy_buffered]), \
+                mock.patch.object(fs, "FADVISE_MIN_SIZE", 1):
+            fs.copy_file(src_path, dst_path)
+        self.check_copied(src_path, dst_path)
+
+    @unittest.skipIf(sys.platform == "win32", "no mmap copy on Windows")
+    def test_copy_mmap(self):
+        src_path = self.create_file(self.src_dir)
+        dst_path = os.path.join(self.dst_dir, self.relpath(src_path))
+        with open(src_path, "ab") as f:
+            f.write(os.urandom(fs.MMAP_COPY_MIN_SIZE))
+
+        with mock.patch.object(fs, "_COPY_FUNCS", [fs._copy_mmap]):
+            fs.copy_file(src_path, dst_path)
+        self.check_copied(src_path, dst_path)
+
+
+class TestParseRsyncOutput(unittest.TestCase):
+    def check_parsed(self, line: bytes, relpath: str, action: fs.Actions):
+        self.assertEqual((relpath, action, ""), fs._parse_rsync_output(line))
+
+    def test_create(self):
+        self.check_parsed(b">f+++++++++ dir/file", "dir/file",
+                          fs.Actions.CREATE)
+        self.check_parsed(b"cd+++++++++ dir/", "dir/", fs.Actions.CREATE)
+        self.check_parsed(b"cL+++++++++ link -> file", "link -> file",
+                          fs.Actions.CREATE)
+
+    def test_delete(self):
+        self.check_parsed(b"*deleting   dir/file", "dir/file",
+                          fs.Actions.DELETE)
+
+    def test_update(self):
+        self.check_parsed(b">f.st...... file", "file", fs.Actions.REWRITE)
+        self.check_parsed(b".d..t...... ./", "./", fs.Actions.UPDATE_TIME)
+        self.check_parsed(b".f...p..... file", "file",
+                          fs.Actions.UPDATE_PERM)
+        self.check_parsed(b".f....og... file", "file",
+                          fs.Actions.UPDATE_OWNER)
+
+    def test_path_with_spaces(self):
+        self.check_parsed(b">f+++++++++ some  file ", "some  file ",
+                          fs.Actions.CREATE)
+
+    def test_same_change_string(self):
+        """ Test cached change string is parsed with different paths. """
+        self.check_parsed(b">f.st...... file1", "file1", fs.Actions.REWRITE)
+        self.check_parsed(b">f.st...... file2", "file2", fs.Actions.REWRITE)
+
+    def test_iter_lines(self):
+        """ Test lines are split correctly between read chunks. """
+        stream = io.BytesIO(b"line1\nlong line2\n\nline3")
+        self.assertEqual([b"line1", b"long line2", b"", b"line3"],
+                         list(fs._iter_lines(stream, chunk_size=4)))
+
+    def test_read_chunks_ahead(self):
+        """ Test only limited amount of chunks is read ahead of caller. """
+        stream = io.BytesIO(b"x" * 100)
+        chunks = fs._read_chunks(stream, chunk_size=1, read_ahead=2)
+        self.assertEqual(b"x", next(chunks))
+        time.sleep(0.2)
+        # two chunks in queue and one waiting to be put there
+        self.assertEqual(4, stream.tell())
+        chunks.close()
+
+    def test_not_parsed(self):
+        with self.assertRaises(RuntimeError):
+            fs._parse_rsync_output(b".f......... file")
 
 
 class TestRsync(CommonFSTestCase):
@@ -262,11 +600,11 @@ class TestRsync(CommonFSTestCase):
         src_spath = self.create_file(self.src_dir)
         dst_spath = os.path.join(self.dst_dir, self.relpath(src_spath))
         os.unlink(src_spath)
-        sock = socket.socket(socket.AF_UNIX)
-        sock.bind(src_spath)
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.bind(src_spath)
 
-        all(fs.rsync(self.src_dir, self.dst_dir))
-        assert not os.path.lexists(dst_spath)
+            all(fs.rsync(self.src_dir, self.dst_dir))
+            assert not os.path.lexists(dst_spath)
 
     def test_src_dst_same_inode(self):
         src_fpath = self.create_file(self.src_dir)
@@ -291,7 +629,108 @@ class TestRsync(CommonFSTestCase):
         assert os.path.lexists(dst_fpath)
         self.check_identical_file(src_fpath, dst_fpath)
 
+    def test_src_symlink_to_dir(self):
+        src_dpath = self.create_dir(self.src_dir)
+        src_lpath = os.path.join(self.src_dir, "symlink_to_dir")
+        os.symlink(self.relpath(src_dpath), src_lpath)
+        dst_lpath = os.path.join(self.dst_dir, "symlink_to_dir")
+
+        all(fs.rsync(self.src_dir, self.dst_dir))
+        assert os.path.islink(dst_lpath)
+        assert os.readlink(dst_lpath) == self.relpath(src_dpath)
+
+    def test_src_dst_diff_permissions(self):
+        src_fpath = self.create_file(self.src_dir)
+        dst_fpath = os.path.join(self.dst_dir, self.relpath(src_fpath))
+        all(fs.rsync(self.src_dir, self.dst_dir))
+        os.chmod(src_fpath, 0o640)
+        os.chmod(dst_fpath, 0o600)
+
+        all(fs.rsync(self.src_dir, self.dst_dir))
+        self.check_identical_file(src_fpath, dst_fpath)
+
+    def test_src_dst_same_file(self):
+        """ Test unchanged file with sub-second mtime is not rewritten. """
+        src_fpath = self.create_file(self.src_dir)
+        os.utime(src_fpath, ns=(1000000000123456789, 1000000000123456789))
+        all(fs.rsync(self.src_dir, self.dst_dir))
+
+        actions = [action for _, action, _ in
+                   fs.rsync(self.src_dir, self.dst_dir)]
+        assert fs.Actions.REWRITE not in actions
+
+    def test_dst_mtime_from_float(self):
+        """ Test file with mtime copied through float is not rewritten. """
+        src_fpath = self.create_file(self.src_dir)
+        os.utime(src_fpath, ns=(1000000000123456789, 1000000000123456789))
+        all(fs.rsync(self.src_dir, self.dst_dir))
+        # mtime set by older versions, last digits of ns are lost
+        dst_fpath = os.path.join(self.dst_dir, self.relpath(src_fpath))
+        src_stat = os.lstat(src_fpath)
+        os.utime(dst_fpath, (src_stat.st_atime, src_stat.st_mtime))
+
+        actions = [action for _, action, _ in
+                   fs.rsync(self.src_dir, self.dst_dir)]
+        assert fs.Actions.REWRITE not in actions
+
+    def test_dir_mtime_ns(self):
+        """ Test directory mtime is restored with nanosecond precision. """
+        src_dpath = self.create_dir(self.src_dir)
+        self.create_file(src_dpath)
+        os.utime(src_dpath, ns=(1000000000123456789, 1000000000123456789))
+        dst_dpath = os.path.join(self.dst_dir, self.relpath(src_dpath))
+
+        all(fs.rsync(self.src_dir, self.dst_dir))
+        assert (os.lstat(src_dpath).st_mtime_ns
+                == os.lstat(dst_dpath).st_mtime_ns)
+
+    def test_dir_mtime_restored(self):
+        """ Test dir mtime is restored both in changed and unchanged dirs. """
+        changed_dpath = self.create_dir(self.src_dir)
+        unchanged_dpath = self.create_dir(self.src_dir)
+        self.create_file(changed_dpath)
+        self.create_file(unchanged_dpath)
+        all(fs.rsync(self.src_dir, self.dst_dir))
+
+        self.create_file(changed_dpath)
+        for dpath in (changed_dpath, unchanged_dpath):
+            os.utime(dpath, (1000000000, 1000000000))
+        all(fs.rsync(self.src_dir, self.dst_dir))
+
+        for dpath in (changed_dpath, unchanged_dpath):
+            dst_dpath = os.path.join(self.dst_dir, self.relpath(dpath))
+            assert os.lstat(dst_dpath).st_mtime == 1000000000
+
+    def test_many_new_files(self):
+        """ Test new files are copied in parallel into new directories. """
+        src_fpaths = []
+        for _ in range(fs.PARALLEL_COPY_MIN_FILES // 4 + 1):
+            src_dpath = self.create_dir(self.src_dir)
+            src_fpaths.extend(self.create_file(src_dpath) for _ in range(4))
+
+        actions = [action for _, action, _ in
+                   fs.rsync(self.src_dir, self.dst_dir)]
+        assert fs.Actions.ERROR not in actions
+        for src_fpath in src_fpaths:
+            dst_fpath = os.path.join(self.dst_dir, self.relpath(src_fpath))
+            self.check_identical_file(src_fpath, dst_fpath)
+
+    def test_many_deleted_dirs(self):
+        """ Test nested dirs missing in source are deleted from dst. """
+        dst_dpaths = []
+        for _ in range(fs.PARALLEL_SCAN_MIN_DIRS + 1):
+            dst_dpath = self.create_dir(self.dst_dir)
+            nested_dpath = self.create_dir(dst_dpath)
+            self.create_file(nested_dpath)
+            dst_dpaths.append(dst_dpath)
+
+        actions = [action for _, action, _ in
+                   fs.rsync(self.src_dir, self.dst_dir)]
+        assert fs.Actions.ERROR not in actions
+        assert actions.count(fs.Actions.DELETE) == 3 * len(dst_dpaths)
+        for dst_dpath in dst_dpaths:
+            assert not os.path.lexists(dst_dpath)
+
     # TODO add tests for changing ownership
-    # TODO add tests for changing permissions
     # TODO add tests for changing times (?)
     # TODO add tests for symlink behaviour